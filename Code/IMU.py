@@ -2,16 +2,27 @@
 	Read Gyro and Accelerometer by Interfacing Raspberry Pi with MPU6050 using Python
 	http://www.electronicwings.com
 '''
-import smbus                    #import SMBus module of I2C
 from time import sleep          #import
+import time
+import struct
+import numpy as np
 import mbl_bots
+from imu_calibration import ImuCalibration
+
+#ACCEL_XOUT_H..GYRO_ZOUT_L: accel x,y,z, temperature, gyro x,y,z (big endian int16)
+BURST_LENGTH = 14
+BURST_FORMAT = '>7h'
+IMU_SCALES = np.array([mbl_bots.ACCEL_SCALE]*3 + [mbl_bots.GYRO_SCALE]*3)
 
 class IMU:
 
 	def __init__(self, bus):
 		#bus = smbus.SMBus(3)    # or bus = smbus.SMBus(0) for older version boards
 		self.bus = bus
-		self.Device_Address = 0x68   # MPU6050 device address
+		self.Device_Address = mbl_bots.MPU6050_ADDRESS   # MPU6050 device address
+		self.sampleRate = 8000.0/(1+7)	# SMPLRT_DIV set in MPU_Init
+		self.streaming = False		# set by ImuStream while it owns INT_STATUS and the FIFO
+		self.calibration = ImuCalibration.load()
 		self.MPU_Init()
 		print ("--> IMU Ready")
 
@@ -27,7 +38,7 @@ class IMU:
 		self.bus.write_byte_data(self.Device_Address, mbl_bots.CONFIG, 0)
 
 		#Write to Gyro configuration register
-		self.bus.write_byte_data(self.Device_Address, mbl_bots.GYRO_CONFIG, 24)
+		self.bus.write_byte_data(self.Device_Address, mbl_bots.GYRO_CONFIG, mbl_bots.GYRO_FS_SEL << 3)
 
 		#Write to interrupt enable register
 		self.bus.write_byte_data(self.Device_Address, mbl_bots.INT_ENABLE, 1)
@@ -46,28 +57,64 @@ class IMU:
 			value = value - 65536
 		return value
 
+	def setSampleRate(self, rate):
+		#Gyro output rate is 8kHz with the DLPF disabled (CONFIG = 0)
+		div = int(round(8000.0/rate)) - 1
+		div = min(max(div, 0), 255)
+		self.bus.write_byte_data(self.Device_Address, mbl_bots.SMPLRT_DIV, div)
+		self.sampleRate = 8000.0/(1+div)
+		return self.sampleRate
+
+	def enableFifo(self):
+		self.bus.write_byte_data(self.Device_Address, mbl_bots.USER_CTRL, mbl_bots.FIFO_RESET_BIT)
+		self.bus.write_byte_data(self.Device_Address, mbl_bots.FIFO_EN, mbl_bots.FIFO_SENSORS)
+		self.bus.write_byte_data(self.Device_Address, mbl_bots.USER_CTRL, mbl_bots.FIFO_ENABLE_BIT)
+
+	def disableFifo(self):
+		self.bus.write_byte_data(self.Device_Address, mbl_bots.FIFO_EN, 0)
+		self.bus.write_byte_data(self.Device_Address, mbl_bots.USER_CTRL, mbl_bots.FIFO_RESET_BIT)
+
+	def resetFifo(self):
+		self.bus.write_byte_data(self.Device_Address, mbl_bots.USER_CTRL, mbl_bots.FIFO_ENABLE_BIT | mbl_bots.FIFO_RESET_BIT)
+
+	def fifoOverflow(self):
+		return bool(self.bus.read_byte_data(self.Device_Address, mbl_bots.INT_STATUS) & mbl_bots.FIFO_OFLOW_BIT)
+
+	def fifoCount(self):
+		data = self.bus.read_i2c_block_data(self.Device_Address, mbl_bots.FIFO_COUNTH, 2)
+		return (data[0] << 8) | data[1]
+
+	def readFifo(self, n):
+		#n whole samples from the FIFO as an (n, 7) raw array, 2 samples per block read
+		buff = bytearray(n*BURST_LENGTH)
+		chunk = 2*BURST_LENGTH
+		pos = 0
+		while pos < len(buff):
+			length = min(chunk, len(buff)-pos)
+			buff[pos:pos+length] = bytearray(self.bus.read_i2c_block_data(self.Device_Address, mbl_bots.FIFO_R_W, length))
+			pos += length
+		return np.frombuffer(bytes(buff), dtype='>i2').reshape(n, 7)
+
+	def read_burst(self):
+		#All sensor registers of the same sample in one block read
+		return self.bus.read_i2c_block_data(self.Device_Address, mbl_bots.ACCEL_XOUT_H, BURST_LENGTH)
+
 	def getImuRawData(self):
 		try:
-	        #Read Accelerometer raw value
-			acc_x = self.read_raw_data(mbl_bots.ACCEL_XOUT_H)
-			acc_y = self.read_raw_data(mbl_bots.ACCEL_YOUT_H)
-			acc_z = self.read_raw_data(mbl_bots.ACCEL_ZOUT_H)
-
-	        #Read Gyroscope raw value
-			gyro_x = self.read_raw_data(mbl_bots.GYRO_XOUT_H)
-			gyro_y = self.read_raw_data(mbl_bots.GYRO_YOUT_H)
-			gyro_z = self.read_raw_data(mbl_bots.GYRO_ZOUT_H)
+			(acc_x, acc_y, acc_z, temp, gyro_x, gyro_y, gyro_z) = struct.unpack(BURST_FORMAT, bytes(bytearray(self.read_burst())))
 
-	        #Full scale range +/- 250 degree/C as per sensitivity scale factor
-			Ax = acc_x/16384.0
-			Ay = acc_y/16384.0
-			Az = acc_z/16384.0
+	        #Sensitivity scale factors of the configured full scale ranges
+			Ax = acc_x/mbl_bots.ACCEL_SCALE
+			Ay = acc_y/mbl_bots.ACCEL_SCALE
+			Az = acc_z/mbl_bots.ACCEL_SCALE
 
-			Gx = gyro_x/131.0
-			Gy = gyro_y/131.0
-			Gz = gyro_z/131.0
+			Gx = gyro_x/mbl_bots.GYRO_SCALE
+			Gy = gyro_y/mbl_bots.GYRO_SCALE
+			Gz = gyro_z/mbl_bots.GYRO_SCALE
 
 			data = [Ax,Ay,Az,Gx,Gy,Gz]
+			if self.calibration is not None:
+				data = self.calibration.apply(np.array(data)).tolist()
 
 		except:
 			data = [0,0,0,0,0,0]
@@ -75,6 +122,46 @@ class IMU:
 		
 		return data
 
+	def raw2data(self, raw):
+		#(n, 7) raw counts --> (n, 6) [Ax,Ay,Az,Gx,Gy,Gz] in g and deg/s
+		data = raw[:, [0,1,2,4,5,6]] / IMU_SCALES
+		if self.calibration is not None:
+			data = self.calibration.apply(data)
+		return data
+
+	def calibrate(self, n=mbl_bots.IMU_CALIBRATION_SAMPLES):
+		#Robot still and flat: estimates the bias and saves it for the next runs
+		self.calibration = None
+		self.calibration = ImuCalibration().estimateStationary(self.getImuBatch(n))
+		self.calibration.save()
+		return self.calibration
+
+	def waitDataReady(self, timeout=mbl_bots.DATA_READY_TIMEOUT):
+		#Polls INT_STATUS until a new sample is in the data registers (reading clears the flag)
+		#Sleeps a fraction of the sample period between polls to leave the bus to the servos
+		pollTime = mbl_bots.DATA_READY_POLL_FRACTION/self.sampleRate
+		deadline = time.monotonic() + timeout
+		while not self.bus.read_byte_data(self.Device_Address, mbl_bots.INT_STATUS) & mbl_bots.DATA_RDY_BIT:
+			if time.monotonic() > deadline:
+				return False
+			sleep(pollTime)
+		return True
+
+	def getImuBatch(self, n):
+		#n consecutive samples as an (n, 6) array, same columns as getImuRawData
+		#Each read waits for a new sample, so no sample is read twice
+		if self.streaming:
+			#Reading INT_STATUS would also clear the FIFO overflow flag the stream checks
+			raise RuntimeError('IMU batch reads are not available while streaming, use ImuStream.window()')
+		buff = bytearray(n*BURST_LENGTH)
+		self.waitDataReady()
+		for i in range(n):
+			if not self.waitDataReady():
+				raise IOError('No new IMU sample after {} s'.format(mbl_bots.DATA_READY_TIMEOUT))
+			buff[i*BURST_LENGTH:(i+1)*BURST_LENGTH] = bytearray(self.read_burst())
+		raw = np.frombuffer(bytes(buff), dtype='>i2').reshape(n, 7)
+		return self.raw2data(raw)
+
 	def getStringImuRawData(self):
 		data = self.getImuRawData()
 		msg = "Gx = {}\tGy = {}\tGz = {}/s \tAx = {}g\tAy = {}g\tAz = {}g".format(data[0],data[1],data[2],data[3],data[4],data[5])
@@ -82,7 +169,7 @@ class IMU:
 
 	def detectCatch(self):
 		data = self.getImuRawData()
-		if(data[3] < 3 or data[4] < 3 or data[5] < 3): 
+		if(abs(data[3]) > mbl_bots.CATCH_GYRO_RATE or abs(data[4]) > mbl_bots.CATCH_GYRO_RATE or abs(data[5]) > mbl_bots.CATCH_GYRO_RATE): 
 			return True
 		else: 
 			return False
@@ -10,10 +10,12 @@ import logging
 import mbl_bots
 import signal
 import os
+import catch_detector
 
 from random import randint
 
 from robot import Robot
+from ranging import UltrasonicRanger
 
 
 
@@ -62,6 +64,10 @@ class LoCoQuad(Robot):
     def INIT(self):
         print("CURRENT STATE: INIT")
         GPIO.setmode(GPIO.BCM) # use Raspberry Pi board pin numbers
+        self.ranger = UltrasonicRanger(GPIO)
+        self.ranger.start()
+        if mbl_bots.CONTINUOUS_CAPTURE or mbl_bots.CAPTURE_PROCESS:
+            self.camera.startCapture()
         self.lastIMU = [0.0,0.0,0.0,0.0,0.0,0.0]
         self.currentIMU = [0.0,0.0,0.0,0.0,0.0,0.0]
         self.lastdata = -1
@@ -77,14 +83,20 @@ class LoCoQuad(Robot):
 #=============================================================================
     def REST(self):
         print("CURRENT STATE: REST")
-        start_time = time.time()
-        while ((time.time()-start_time)<mbl_bots.REST_TIME):
-            if(self.imu.detectCatch()):
+        if self.catchDetector is not None:
+            #Sleeps until the robot is picked up or the rest time is over
+            if self.catchDetector.waitFor(catch_detector.PICKED_UP, mbl_bots.REST_TIME):
                 for i in range(3):
                     super(LoCoQuad, self).shake()
-                break
-            else:
-                time.sleep(0.2)
+        else:
+            start_time = time.time()
+            while ((time.time()-start_time)<mbl_bots.REST_TIME):
+                if(self.imu.detectCatch()):
+                    for i in range(3):
+                        super(LoCoQuad, self).shake()
+                    break
+                else:
+                    time.sleep(0.2)
         time.sleep(1)
         self.state = mbl_bots.EXPLORE
 
@@ -121,7 +133,7 @@ class LoCoQuad(Robot):
     def exploreGetData(self):
         print("CURRENT STATE: EXPLORE")
         print("CURRENT SUBSTATE: DATA ACQUISITION")
-        self.distance = utils.getDistance()
+        self.distance = self.ranger.getDistance()
         self.lastIMU = self.currentIMU
         self.currentIMU = self.imu.getImuRawData()
         start_time = time.time()
@@ -157,15 +169,15 @@ class LoCoQuad(Robot):
         
 
         if ((time.time()-self.exploreTime)>mbl_bots.EXPLORATION_TIME):
+            self.motion.cancel()
+            self.motion.wait()
             self.exploreState = mbl_bots.GETDATA
             self.state = mbl_bots.REST
 
         else:
-            start_time = time.time()
-            #super(LoCoQuad, self).turnRight()
-            end_time = time.time()
-            print(' ')
-            print('It took me {} s to move'.format(start_time-end_time))
+            #The move runs in the motion thread, so data acquisition goes on while walking
+            if not self.motion.busy():
+                super(LoCoQuad, self).moveAsync(self.movesCode)
             self.exploreState = mbl_bots.GETDATA
             self.state = mbl_bots.EXPLORE
 
@@ -195,6 +207,11 @@ class LoCoQuad(Robot):
     def close(self, signal, frame):
         #self.camera.close()
         print("\nTurning off LoCoQuad Activity...\n")
+        self.motion.stop()
+        if self.imuStream is not None:
+            self.imuStream.stop()
+        self.ranger.stop()
+        self.camera.stopCapture()
         GPIO.cleanup() 
         sys.exit(0)
 
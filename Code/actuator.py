@@ -1,3 +1,7 @@
+import numpy as np
+import mbl_bots
+
+
 class Actuator(object):
     """docstring for Actuator"""
     def __init__(self, *args):
@@ -13,4 +17,61 @@ class Actuator(object):
         self.sonid = args[0][8]
                 
     def printshow(self):
-        print("This is Actuator: ", self.name)
\ No newline at end of file
+        print("This is Actuator: ", self.name)
+
+class ActuatorTable(object):
+    """Actuators of the botfile compiled into arrays, one row per actuator.
+
+    Poses are vectors of movefile angles; they are converted to pulses,
+    clamped to the actuator limits and turned into 12-bit PCA9685 counts
+    in a single vectorized step.
+    """
+    __slots__ = ('names', 'index', 'channel', 'center', 'min', 'max', 'factor', 'rows',
+                 'order', 'frameChannels')
+
+    def __init__(self, actuators):
+        super(ActuatorTable, self).__init__()
+        self.names = tuple(acc.name for acc in actuators)
+        self.index = dict((name, i) for (i, name) in enumerate(self.names))
+        self.channel = np.array([int(acc.adress) for acc in actuators], dtype=np.intp)
+        self.center = np.array([acc.center for acc in actuators], dtype=np.float64)
+        self.min = np.array([acc.min for acc in actuators], dtype=np.float64)
+        self.max = np.array([acc.max for acc in actuators], dtype=np.float64)
+        #Pulse [us] to count, the PWM frequency is 50HZ (period 20000us)
+        self.factor = float(mbl_bots.PWM_RESOLUTION)/mbl_bots.PWM_PERIOD_US
+        #Plain python rows (channel, min, max) for single commands
+        self.rows = [(int(self.channel[i]), acc.min, acc.max) for (i, acc) in enumerate(actuators)]
+        #Actuators sorted by channel, for whole-pose frames
+        self.order = np.argsort(self.channel, kind='stable')
+        self.frameChannels = tuple(self.channel[self.order].tolist())
+
+    def __len__(self):
+        return len(self.names)
+
+    def indices(self, names):
+        try:
+            return np.array([self.index[name] for name in names], dtype=np.intp)
+        except KeyError as e:
+            raise ValueError('unknown actuator %s' % e.args[0])
+
+    def pose2pulses(self, pose, idx=None):
+        #pose: angles of every actuator (or of the actuators in idx), any leading shape
+        if idx is None:
+            idx = slice(None)
+        pulses = np.asarray(pose, dtype=np.float64)*mbl_bots.SCALE_ACC + mbl_bots.CNT_ACC
+        return np.clip(pulses, self.min[idx], self.max[idx])
+
+    def pose2counts(self, pose, idx=None):
+        return np.floor(self.pose2pulses(pose, idx)*self.factor).astype(np.uint16)
+
+    def pose2frame(self, pose):
+        #(channels, counts) of a whole pose, in channel order for the driver
+        return self.frameChannels, self.pose2counts(pose)[self.order].tolist()
+
+    def count(self, name, pos):
+        #Single command: (channel, count) with plain python math
+        (channel, acc_min, acc_max) = self.rows[self.index[name]]
+        pulse = pos*mbl_bots.SCALE_ACC + mbl_bots.CNT_ACC
+        if (pulse > acc_max): pulse = acc_max
+        if (pulse < acc_min): pulse = acc_min
+        return channel, int(pulse*self.factor)
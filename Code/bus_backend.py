@@ -0,0 +1,258 @@
+import time
+import errno
+import threading
+import numpy as np
+import mbl_bots
+
+
+def openBus(backend=mbl_bots.BUS_BACKEND, busnum=mbl_bots.I2C_BUS):
+	#Returns an smbus compatible object: the real bus or the simulator
+	if backend == 'smbus':
+		import smbus
+		return smbus.SMBus(busnum)
+	elif backend == 'sim':
+		bus = SimBus()
+		bus.addDevice(mbl_bots.PCA9685_ADDRESS, SimPCA9685())
+		bus.addDevice(mbl_bots.MPU6050_ADDRESS, SimMPU6050())
+		return bus
+	else:
+		raise ValueError('Unknown bus backend: %s' % backend)
+
+
+class SimDevice(object):
+	"""Register file of a simulated I2C device"""
+	def __init__(self, size=256):
+		super(SimDevice, self).__init__()
+		self.regs = bytearray(size)
+
+	def autoIncrement(self):
+		return True
+
+	def writeRegs(self, reg, values):
+		if self.autoIncrement():
+			for i in range(len(values)):
+				self.writeReg((reg+i) % len(self.regs), values[i])
+		else:
+			for v in values:
+				self.writeReg(reg, v)
+
+	def readRegs(self, reg, length):
+		self.beforeRead(reg, length)
+		if self.autoIncrement():
+			return [self.regs[(reg+i) % len(self.regs)] for i in range(length)]
+		return [self.regs[reg]]*length
+
+	def writeReg(self, reg, value):
+		self.regs[reg] = value & 0xFF
+
+	def beforeRead(self, reg, length):
+		pass
+
+
+class SimPCA9685(SimDevice):
+	"""PCA9685 register map: MODE1 auto-increment and ALL_LED broadcast"""
+	MODE1 = 0x00
+	LED0_ON_L = 0x06
+	ALLLED_ON_L = 0xFA
+	PRESCALE = 0xFE
+
+	def __init__(self):
+		super(SimPCA9685, self).__init__()
+		self.regs[self.MODE1] = 0x11
+		self.regs[self.PRESCALE] = 0x1E
+
+	def autoIncrement(self):
+		return bool(self.regs[self.MODE1] & 0x20)
+
+	def writeReg(self, reg, value):
+		self.regs[reg] = value & 0xFF
+		if self.ALLLED_ON_L <= reg < self.ALLLED_ON_L+4:
+			for c in range(16):
+				self.regs[self.LED0_ON_L+4*c+reg-self.ALLLED_ON_L] = value & 0xFF
+
+	def channel(self, ch):
+		#(on, off) counts of a channel
+		r = self.LED0_ON_L+4*ch
+		return (self.regs[r] | (self.regs[r+1] << 8), self.regs[r+2] | (self.regs[r+3] << 8))
+
+
+class SimMPU6050(SimDevice):
+	"""MPU6050 register map with data registers refreshed at the sample rate.
+
+	source(t) returns the raw (ax, ay, az, temp, gx, gy, gz) counts at time t,
+	by default a robot standing still with some sensor noise. Samples are
+	generated lazily on every read, catching up with the elapsed time, and
+	pushed to the FIFO when it is enabled.
+	"""
+	WHO_AM_I = 0x75
+	PWR_MGMT_1 = 0x6B
+
+	def __init__(self, source=None, clock=time.monotonic):
+		super(SimMPU6050, self).__init__(128)
+		self.regs[self.WHO_AM_I] = 0x68
+		self.regs[self.PWR_MGMT_1] = 0x40
+		self.source = source if source is not None else self.stillSource
+		self.clock = clock
+		self.lastSample = None
+		self.rng = np.random.default_rng(0)
+		self.fifo = bytearray()
+
+	def stillSource(self, t):
+		noise = self.rng.normal(0.0, [40, 40, 40, 0, 15, 15, 15])
+		return (np.array([0, 0, 16384, 0, 0, 0, 0]) + noise).astype(np.int64)
+
+	def samplePeriod(self):
+		#Gyro output rate is 8kHz without DLPF, 1kHz with it
+		rate = 8000.0 if (self.regs[mbl_bots.CONFIG] & 0x07) in (0, 7) else 1000.0
+		return (1.0 + self.regs[mbl_bots.SMPLRT_DIV])/rate
+
+	def fifoEnabled(self):
+		return bool(self.regs[mbl_bots.USER_CTRL] & mbl_bots.FIFO_ENABLE_BIT) and \
+			self.regs[mbl_bots.FIFO_EN] == mbl_bots.FIFO_SENSORS
+
+	def sample(self):
+		#Generates the samples due since the last one, returns how many
+		t = self.clock()
+		period = self.samplePeriod()
+		if self.lastSample is None:
+			self.lastSample = t - period
+		n = int((t-self.lastSample)/period)
+		if n == 0:
+			return 0
+		#Only the FIFO can hold more than one pending sample
+		n_kept = min(n, mbl_bots.FIFO_SIZE//14 + 1)
+		first = self.lastSample + (n-n_kept+1)*period
+		self.lastSample += n*period
+		for k in range(n_kept):
+			values = np.clip(np.asarray(self.source(first+k*period)), -32768, 32767).astype('>i2').tobytes()
+			if self.fifoEnabled():
+				if len(self.fifo)+14 > mbl_bots.FIFO_SIZE:
+					self.regs[mbl_bots.INT_STATUS] |= mbl_bots.FIFO_OFLOW_BIT
+				else:
+					self.fifo += values
+		self.regs[mbl_bots.ACCEL_XOUT_H:mbl_bots.ACCEL_XOUT_H+14] = values
+		self.regs[mbl_bots.INT_STATUS] |= mbl_bots.DATA_RDY_BIT
+		return n
+
+	def writeReg(self, reg, value):
+		if reg == mbl_bots.USER_CTRL and value & mbl_bots.FIFO_RESET_BIT:
+			self.fifo = bytearray()
+			value &= ~mbl_bots.FIFO_RESET_BIT
+		self.regs[reg] = value & 0xFF
+
+	def beforeRead(self, reg, length):
+		self.sample()
+		count = len(self.fifo)
+		self.regs[mbl_bots.FIFO_COUNTH] = count >> 8
+		self.regs[mbl_bots.FIFO_COUNTH+1] = count & 0xFF
+
+	def readRegs(self, reg, length):
+		if reg == mbl_bots.FIFO_R_W:
+			#FIFO reads do not increment the register, they pop bytes
+			self.sample()
+			data = list(self.fifo[:length]) + [0]*max(length-len(self.fifo), 0)
+			del self.fifo[:length]
+			return data
+		data = super(SimMPU6050, self).readRegs(reg, length)
+		if reg <= mbl_bots.INT_STATUS < reg+length:
+			self.regs[mbl_bots.INT_STATUS] &= ~(mbl_bots.FIFO_OFLOW_BIT | mbl_bots.DATA_RDY_BIT)
+		return data
+
+
+class SimBus(object):
+	"""In-process SMBus replacement with per-transaction I2C timing.
+
+	Transaction time is the number of bits on the wire (9 per byte plus
+	start/stop) at the configured clock, plus a fixed driver overhead.
+	The time is always accumulated in busTime; with realtime set the call
+	also takes that long, so control loops see the real bus budget.
+	"""
+	def __init__(self, clock=mbl_bots.I2C_CLOCK, realtime=mbl_bots.SIM_BUS_REALTIME,
+				overhead=mbl_bots.SIM_BUS_OVERHEAD):
+		super(SimBus, self).__init__()
+		self.clock = clock
+		self.realtime = realtime
+		self.overhead = overhead
+		self.devices = {}
+		self.lock = threading.Lock()
+		self.resetStats()
+
+	def addDevice(self, address, device):
+		self.devices[address] = device
+		return device
+
+	def resetStats(self):
+		self.transactions = 0
+		self.bytesWritten = 0
+		self.bytesRead = 0
+		self.busTime = 0.0
+		self.perDevice = {}
+
+	def getStats(self):
+		return {'transactions': self.transactions,
+				'bytes_written': self.bytesWritten,
+				'bytes_read': self.bytesRead,
+				'bus_time': self.busTime,
+				'per_device': dict(self.perDevice)}
+
+	def device(self, address):
+		dev = self.devices.get(address)
+		if dev is None:
+			raise IOError(errno.EREMOTEIO, 'No device at address 0x%02X' % address)
+		return dev
+
+	def transaction(self, address, written, read):
+		#written/read: bytes after the address byte(s); reads add a repeated start
+		bits = 2 + 9*(1+written)
+		if read > 0:
+			bits += 1 + 9*(1+read)
+		duration = bits/float(self.clock) + self.overhead
+		self.transactions += 1
+		self.bytesWritten += written
+		self.bytesRead += read
+		self.busTime += duration
+		self.perDevice[address] = self.perDevice.get(address, 0) + 1
+		if self.realtime:
+			end = time.perf_counter() + duration
+			while time.perf_counter() < end:
+				pass
+
+	def write_byte_data(self, address, reg, value):
+		with self.lock:
+			self.device(address).writeRegs(reg, [value])
+			self.transaction(address, 2, 0)
+
+	def read_byte_data(self, address, reg):
+		with self.lock:
+			value = self.device(address).readRegs(reg, 1)[0]
+			self.transaction(address, 1, 1)
+			return value
+
+	def write_word_data(self, address, reg, value):
+		with self.lock:
+			self.device(address).writeRegs(reg, [value & 0xFF, (value >> 8) & 0xFF])
+			self.transaction(address, 3, 0)
+
+	def read_word_data(self, address, reg):
+		with self.lock:
+			data = self.device(address).readRegs(reg, 2)
+			self.transaction(address, 1, 2)
+			return data[0] | (data[1] << 8)
+
+	def write_i2c_block_data(self, address, reg, values):
+		if len(values) > 32:
+			raise ValueError('SMBus block transfers are limited to 32 bytes')
+		with self.lock:
+			self.device(address).writeRegs(reg, list(values))
+			self.transaction(address, 1+len(values), 0)
+
+	def read_i2c_block_data(self, address, reg, length=32):
+		if length > 32:
+			raise ValueError('SMBus block transfers are limited to 32 bytes')
+		with self.lock:
+			data = self.device(address).readRegs(reg, length)
+			self.transaction(address, 1, length)
+			return data
+
+	def close(self):
+		pass
@@ -2,6 +2,91 @@ from time import sleep
 from picamera import PiCamera
 from picamera.array import PiRGBArray
 import datetime
+import time
+import threading
+import numpy as np
+import mbl_bots
+
+
+def alignUp(value, align):
+	return (value + align - 1) // align * align
+
+
+def frameLayout(format, resolution):
+	#(bytes per frame, function returning the frame view of a flat buffer)
+	#The camera pads raw frames to 32 columns and 16 rows
+	(width, height) = resolution
+	(fwidth, fheight) = (alignUp(width, 32), alignUp(height, 16))
+	if format == "yuv":
+		#I420: full size Y plane followed by the quarter size U and V planes.
+		#The Y plane is the grayscale image.
+		nbytes = fwidth*fheight + 2*(fwidth//2)*(fheight//2)
+		return nbytes, lambda b: b[:fwidth*fheight].reshape(fheight, fwidth)[:height, :width]
+	nbytes = fwidth*fheight*3
+	return nbytes, lambda b: b.reshape(fheight, fwidth, 3)[:height, :width]
+
+
+class FrameBuffers(object):
+	"""File-like picamera output that fills N preallocated frame buffers.
+
+	Every complete frame is published as the latest one with its capture
+	time and sequence number, and writing moves on to a buffer that is
+	neither the latest nor the one a reader currently holds, so readers get
+	frames without copies and without waiting for the camera. With the
+	"yuv" format the frames are grayscale views over the Y planes.
+	"""
+	def __init__(self, resolution, n=3, format="bgr"):
+		super(FrameBuffers, self).__init__()
+		if n < 3:
+			#With two, the buffer to write could be the one handed to the reader
+			raise ValueError('FrameBuffers needs at least 3 buffers')
+		(self.size, view) = frameLayout(format, resolution)
+		self.format = format
+		flat = [np.zeros(self.size, dtype=np.uint8) for i in range(n)]
+		self.buffers = [view(b) for b in flat]
+		self.views = [memoryview(b) for b in flat]
+		self.cond = threading.Condition()
+		self.writeIdx = 0
+		self.pos = 0
+		self.latest = None
+		self.reading = None
+		self.seq = 0
+		self.timestamp = None
+
+	def write(self, data):
+		n = len(data)
+		end = min(self.pos+n, self.size)
+		self.views[self.writeIdx][self.pos:end] = data[:end-self.pos]
+		self.pos = end
+		if self.pos == self.size:
+			self.frameDone()
+		return n
+
+	def flush(self):
+		pass
+
+	def frameDone(self):
+		with self.cond:
+			self.latest = self.writeIdx
+			self.timestamp = time.monotonic()
+			self.seq += 1
+			self.pos = 0
+			#With 3 or more buffers one is neither the latest nor the reader's
+			for i in range(1, len(self.buffers)+1):
+				idx = (self.writeIdx+i) % len(self.buffers)
+				if idx != self.latest and idx != self.reading:
+					break
+			self.writeIdx = idx
+			self.cond.notify_all()
+
+	def acquire(self, newerThan=0, timeout=None):
+		#(frame, timestamp, seq) of the latest frame with seq > newerThan, or None on timeout.
+		#The frame stays untouched until the next acquire.
+		with self.cond:
+			if not self.cond.wait_for(lambda: self.seq > newerThan, timeout):
+				return None
+			self.reading = self.latest
+			return self.buffers[self.latest], self.timestamp, self.seq
 
 
 class Cam(object):
@@ -11,8 +96,49 @@ class Cam(object):
 		self.camera.rotation = 180
 		self.camera.framerate = 32
 		self.rawCapture = PiRGBArray(self.camera, size=(640, 480))
-	
+		#"yuv" hands grayscale Y planes to the vision pipeline, "bgr" colour frames
+		self.format = mbl_bots.CAPTURE_FORMAT
+		(nbytes, view) = frameLayout("yuv", self.camera.resolution)
+		self.yuvBuffer = np.zeros(nbytes, dtype=np.uint8)
+		self.grayFrame = view(self.yuvBuffer)
+		self.frameBuffers = None
+		self.captureThread = None
+		self.capturing = False
+		self.lastSeq = 0
+
+	def startCapture(self, n_buffers=mbl_bots.CAPTURE_BUFFERS):
+		#Continuous capture from the video port in a background thread
+		self.frameBuffers = FrameBuffers(self.camera.resolution, n_buffers, self.format)
+		self.capturing = True
+		self.captureThread = threading.Thread(target=self.captureLoop)
+		self.captureThread.daemon = True
+		self.captureThread.start()
+
+	def captureLoop(self):
+		for output in self.camera.capture_continuous(self.frameBuffers, format=self.format, use_video_port=True):
+			if not self.capturing:
+				break
+
+	def stopCapture(self):
+		self.capturing = False
+		if self.captureThread is not None:
+			self.captureThread.join()
+		self.captureThread = None
+
+	def getLatestFrame(self, newerThan=0, timeout=mbl_bots.CAPTURE_TIMEOUT):
+		#(frame, timestamp, seq) from the capture thread, None on timeout
+		return self.frameBuffers.acquire(newerThan, timeout)
+
 	def getFrame(self):
+		if self.capturing:
+			#Newest frame not returned yet (waits only if the camera is behind)
+			latest = self.getLatestFrame(self.lastSeq)
+			if latest is None:
+				raise IOError('No frame from the capture thread')
+			(self.frame, timestamp, self.lastSeq) = latest
+			return self.frame
+		if self.format == "yuv":
+			return self.getGrayFrame()
 		self.camera.start_preview()
 		self.camera.capture(self.rawCapture, use_video_port=True, format="bgr")
 		self.frame = self.rawCapture.array
@@ -21,6 +147,19 @@ class Cam(object):
 		self.camera.stop_preview()
 		return self.frame
 
+	def getGrayFrame(self):
+		#Y plane captured straight into the reused buffer, no colour conversion
+		self.camera.capture(self.yuvBuffer, format="yuv", use_video_port=True)
+		self.frame = self.grayFrame
+		return self.frame
+
+	def getColorFrame(self):
+		#BGR frame, from the still port while the video port is capturing
+		self.camera.capture(self.rawCapture, use_video_port=not self.capturing, format="bgr")
+		frame = self.rawCapture.array
+		self.rawCapture.truncate(0)
+		return frame
+
 	def getFrame2(self):
 		for frame in self.camera.capture_continuous(self.rawCapture, format="bgr", use_video_port=True):
 			# grab the raw NumPy array representing the image, then initialize the timestamp
@@ -44,7 +183,8 @@ class Cam(object):
 		return self.frame
 
 	def truncateFrame(self):
-		self.rawCapture.truncate(0)
+		if not self.capturing:
+			self.rawCapture.truncate(0)
 
 	def takePic(self, output_dir="./Captures/"):
 		self.camera.start_preview()
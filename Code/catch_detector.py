@@ -0,0 +1,139 @@
+import threading
+import numpy as np
+import mbl_bots
+
+PICKED_UP = 'picked_up'
+SET_DOWN = 'set_down'
+FALLEN = 'fallen'
+
+#Detector states
+RESTING = 0
+HELD = 1
+LYING = 2
+
+
+class RunningWindow(object):
+	"""Sliding window of the last n values with O(1) mean and variance"""
+	def __init__(self, n):
+		super(RunningWindow, self).__init__()
+		self.values = np.zeros(n)
+		self.n = n
+		self.reset()
+
+	def reset(self):
+		self.pos = 0
+		self.count = 0
+		self.sum = 0.0
+		self.sumSq = 0.0
+
+	def push(self, value):
+		old = self.values[self.pos]
+		self.values[self.pos] = value
+		if self.count < self.n:
+			self.count += 1
+			old = 0.0
+		self.sum += value - old
+		self.sumSq += value*value - old*old
+		self.pos += 1
+		if self.pos == self.n:
+			#Recompute the sums once per lap so rounding errors do not build up
+			self.pos = 0
+			self.sum = float(np.sum(self.values))
+			self.sumSq = float(np.dot(self.values, self.values))
+
+	def full(self):
+		return self.count == self.n
+
+	def mean(self):
+		return self.sum/self.count if self.count else 0.0
+
+	def variance(self):
+		if self.count == 0:
+			return 0.0
+		mean = self.sum/self.count
+		return max(self.sumSq/self.count - mean*mean, 0.0)
+
+
+class CatchDetector(object):
+	"""Detects the robot being picked up, set down or fallen from IMU samples.
+
+	Keeps running mean and variance of the acceleration magnitude, the mean
+	jerk and the mean vertical acceleration over a sliding window, each
+	updated in O(1) per sample. A condition has to hold for its debounce
+	time before the state changes, and every change raises an event to the
+	registered callbacks (called from the thread feeding the samples).
+	reset() drops the window contents, e.g. after samples taken while the
+	robot was moving, and keeps the state.
+	"""
+	def __init__(self, window=mbl_bots.CATCH_WINDOW):
+		super(CatchDetector, self).__init__()
+		self.magnitude = RunningWindow(window)
+		self.jerk = RunningWindow(window)
+		self.vertical = RunningWindow(window)
+		self.callbacks = {PICKED_UP: [], SET_DOWN: [], FALLEN: []}
+		self.events = {PICKED_UP: threading.Event(), SET_DOWN: threading.Event(), FALLEN: threading.Event()}
+		self.state = RESTING
+		self.lastMagnitude = None
+		self.lastTime = None
+		self.since = {}
+
+	def reset(self):
+		self.magnitude.reset()
+		self.jerk.reset()
+		self.vertical.reset()
+		self.lastMagnitude = None
+		self.lastTime = None
+		self.since.clear()
+
+	def addCallback(self, event, callback):
+		self.callbacks[event].append(callback)
+
+	def waitFor(self, event, timeout=None):
+		#Blocks until the event is raised (True) or the timeout expires (False)
+		self.events[event].clear()
+		return self.events[event].wait(timeout)
+
+	def held(self, name, condition, t, debounce):
+		#True once the condition has been true for debounce seconds
+		if not condition:
+			self.since.pop(name, None)
+			return False
+		start = self.since.setdefault(name, t)
+		return t-start >= debounce
+
+	def fire(self, event, t):
+		self.since.clear()
+		self.events[event].set()
+		for callback in self.callbacks[event]:
+			callback(event, t)
+
+	def update(self, times, data):
+		for k in range(len(times)):
+			self.updateSample(times[k], data[k])
+
+	def updateSample(self, t, sample):
+		m = (sample[0]*sample[0] + sample[1]*sample[1] + sample[2]*sample[2])**0.5
+		if self.lastTime is not None and t > self.lastTime:
+			self.jerk.push(abs(m-self.lastMagnitude)/(t-self.lastTime))
+		self.lastMagnitude = m
+		self.lastTime = t
+		self.magnitude.push(m)
+		self.vertical.push(sample[2])
+		if not self.magnitude.full():
+			return
+
+		variance = self.magnitude.variance()
+		jerk = self.jerk.mean()
+		moving = variance > mbl_bots.CATCH_VARIANCE or jerk > mbl_bots.CATCH_JERK
+		still = variance < mbl_bots.SETDOWN_VARIANCE and jerk < mbl_bots.SETDOWN_JERK
+		upright = self.vertical.mean() > mbl_bots.FALLEN_MIN_AZ
+
+		if self.state != HELD and self.held('moving', moving, t, mbl_bots.CATCH_DEBOUNCE):
+			self.state = HELD
+			self.fire(PICKED_UP, t)
+		elif self.state != LYING and self.held('lying', still and not upright, t, mbl_bots.FALLEN_DEBOUNCE):
+			self.state = LYING
+			self.fire(FALLEN, t)
+		elif self.state != RESTING and self.held('resting', still and upright, t, mbl_bots.SETDOWN_DEBOUNCE):
+			self.state = RESTING
+			self.fire(SET_DOWN, t)
@@ -0,0 +1,150 @@
+import bisect
+from collections import deque
+import mbl_bots
+
+#MAD to standard deviation for normally distributed values
+MAD_SIGMA = 1.4826
+
+
+def kthOfTwo(a, a0, a1, b, b0, b1, k):
+	#k-th smallest (0 based) of the sorted ranges a[a0:a1] and b[b0:b1], O(log n)
+	while True:
+		if a0 == a1:
+			return b[b0+k]
+		if b0 == b1:
+			return a[a0+k]
+		if k == 0:
+			return min(a[a0], b[b0])
+		i = min(a1-a0, (k+1)//2)
+		j = min(b1-b0, (k+1)//2)
+		if a[a0+i-1] <= b[b0+j-1]:
+			a0 += i
+			k -= i
+		else:
+			b0 += j
+			k -= j
+
+
+class ShiftedDistances(object):
+	#s[p+i] - m as a read-only sequence
+	__slots__ = ('s', 'p', 'm')
+
+	def __init__(self, s, p, m):
+		self.s = s
+		self.p = p
+		self.m = m
+
+	def __getitem__(self, i):
+		return self.s[self.p+i] - self.m
+
+
+class MirroredDistances(object):
+	#m - s[p-1-i] as a read-only sequence
+	__slots__ = ('s', 'p', 'm')
+
+	def __init__(self, s, p, m):
+		self.s = s
+		self.p = p
+		self.m = m
+
+	def __getitem__(self, i):
+		return self.m - self.s[self.p-1-i]
+
+
+class DistanceEstimator(object):
+	"""Robust running estimate of the distance from a bounded ping history.
+
+	Pings are kept in arrival order (to expire them by count and age) and
+	in a sorted list, so the median is an index lookup. Insertions and
+	removals find their place with a binary search but shift the list,
+	O(n) memmoves that stay negligible for a RANGE_HISTORY sized window.
+	The MAD is the median of |x - median|, found as the k-th element of the
+	two sorted distance sequences on each side of the median in O(log n),
+	without sorting the deviations. A ping further than RANGE_MAD_K
+	robust sigmas from the median is rejected, unless several in a row
+	disagree, which means the scene changed.
+	"""
+	def __init__(self, size=mbl_bots.RANGE_HISTORY, maxAge=mbl_bots.RANGE_MAX_AGE,
+				minValid=mbl_bots.RANGE_MIN_VALID, k=mbl_bots.RANGE_MAD_K):
+		super(DistanceEstimator, self).__init__()
+		self.size = size
+		self.maxAge = maxAge
+		self.minValid = minValid
+		self.k = k
+		self.pings = deque()
+		self.sorted = []
+		self.rejected = 0
+		self.pending = []		#consecutive rejected pings
+		self.lastTime = None
+
+	def remove(self, value):
+		i = bisect.bisect_left(self.sorted, value)
+		del self.sorted[i]
+
+	def expire(self, t):
+		while self.pings and (len(self.pings) > self.size or t-self.pings[0][0] > self.maxAge):
+			self.remove(self.pings.popleft()[1])
+
+	def median(self):
+		n = len(self.sorted)
+		if n == 0:
+			return None
+		if n % 2:
+			return self.sorted[n//2]
+		return 0.5*(self.sorted[n//2-1] + self.sorted[n//2])
+
+	def mad(self):
+		n = len(self.sorted)
+		if n == 0:
+			return None
+		m = self.median()
+		s = self.sorted
+		p = bisect.bisect_left(s, m)
+		#Distances below the median in ascending order are s[p-1], s[p-2]... so use a mirrored view
+		left = MirroredDistances(s, p, m)
+		right = ShiftedDistances(s, p, m)
+		if n % 2:
+			return kthOfTwo(left, 0, p, right, 0, n-p, n//2)
+		return 0.5*(kthOfTwo(left, 0, p, right, 0, n-p, n//2-1) + kthOfTwo(left, 0, p, right, 0, n-p, n//2))
+
+	def isOutlier(self, value):
+		if len(self.sorted) < self.minValid:
+			return False
+		m = self.median()
+		spread = max(MAD_SIGMA*self.mad(), mbl_bots.RANGE_MAD_FLOOR)
+		return abs(value-m) > self.k*spread
+
+	def update(self, t, value):
+		#Returns True if the ping was accepted
+		self.expire(t)
+		if value is None or value < 0.0:
+			return False
+		if self.isOutlier(value):
+			self.rejected += 1
+			self.pending = [p for p in self.pending if t-p[0] <= self.maxAge]
+			self.pending.append((t, value))
+			if len(self.pending) < self.minValid:
+				return False
+			#Several rejections in a row: the scene changed, restart from them
+			self.pings.clear()
+			self.sorted = []
+			for (tp, vp) in self.pending:
+				self.insert(tp, vp)
+			self.pending = []
+			self.expire(t)
+			return True
+		self.pending = []
+		self.insert(t, value)
+		self.expire(t)
+		return True
+
+	def insert(self, t, value):
+		self.pings.append((t, value))
+		bisect.insort(self.sorted, value)
+		self.lastTime = t
+
+	def estimate(self, t):
+		#(distance, mad, valid) at time t
+		self.expire(t)
+		valid = len(self.sorted) >= self.minValid
+		return (self.median(), self.mad(), valid)
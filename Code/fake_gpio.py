@@ -0,0 +1,89 @@
+import time
+import threading
+
+#Same names as RPi.GPIO
+BCM = 11
+BOARD = 10
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+RISING = 31
+FALLING = 32
+BOTH = 33
+PUD_OFF = 20
+
+
+class FakeGPIO(object):
+	"""Stand-in for RPi.GPIO with an HC-SR04 style sensor between two pins.
+
+	A falling edge on the trigger pin schedules an echo pulse on the echo
+	pin whose width matches self.distance (cm), or no echo at all when it
+	is None. Edge callbacks are called from timer threads, like RPi.GPIO
+	calls them from its own thread.
+	"""
+	BCM = BCM
+	BOARD = BOARD
+	OUT = OUT
+	IN = IN
+	LOW = LOW
+	HIGH = HIGH
+	RISING = RISING
+	FALLING = FALLING
+	BOTH = BOTH
+	PUD_OFF = PUD_OFF
+
+	def __init__(self, trig, echo, distance=100.0, echoDelay=0.0002):
+		super(FakeGPIO, self).__init__()
+		self.trig = trig
+		self.echo = echo
+		self.distance = distance
+		self.echoDelay = echoDelay
+		self.levels = {}
+		self.callbacks = {}
+		self.mode = None
+		self.pings = 0
+
+	def setmode(self, mode):
+		self.mode = mode
+
+	def setwarnings(self, flag):
+		pass
+
+	def setup(self, channel, direction, pull_up_down=PUD_OFF, initial=LOW):
+		self.levels[channel] = initial if direction == OUT else LOW
+
+	def input(self, channel):
+		return self.levels.get(channel, LOW)
+
+	def output(self, channel, value):
+		old = self.levels.get(channel, LOW)
+		self.levels[channel] = HIGH if value else LOW
+		if channel == self.trig and old == HIGH and not value:
+			self.pings += 1
+			self.scheduleEcho()
+
+	def scheduleEcho(self):
+		if self.distance is None:
+			return
+		width = 2.0*self.distance/34300.0
+		threading.Timer(self.echoDelay, self.setEcho, (HIGH,)).start()
+		threading.Timer(self.echoDelay+width, self.setEcho, (LOW,)).start()
+
+	def setEcho(self, level):
+		self.levels[self.echo] = level
+		(edge, callback) = self.callbacks.get(self.echo, (None, None))
+		if callback is None:
+			return
+		if edge == BOTH or (edge == RISING and level == HIGH) or (edge == FALLING and level == LOW):
+			callback(self.echo)
+
+	def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+		self.callbacks[channel] = (edge, callback)
+
+	def remove_event_detect(self, channel):
+		self.callbacks.pop(channel, None)
+
+	def cleanup(self, channel=None):
+		self.callbacks = {}
+		self.levels = {}
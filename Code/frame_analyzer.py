@@ -25,6 +25,7 @@ import sys, time, math, os
 
 import scipy.signal as sci
 import scipy.ndimage as sci2 
+from concurrent.futures import ThreadPoolExecutor, Future
 
 import mbl_bots as ac
 
@@ -37,6 +38,9 @@ class Analyzer():
 		#--- Define Tag Sizes
 		self.TAG_SIZE_SMALL = ac.TAG1_SIZE 
 		self.TAG_SIZE_BIG = ac.TAG2_SIZE 
+		#--- Persistent workers for the per-dictionary work (OpenCV releases the GIL)
+		self.pool = ThreadPoolExecutor(max_workers=ac.ARUCO_WORKERS) if ac.ARUCO_WORKERS > 0 else None
+		self.timings = {}
 
 ###############################################################################
 
@@ -45,6 +49,35 @@ class Analyzer():
 		self.aruco_dict_small  = aruco.getPredefinedDictionary(aruco.DICT_5X5_100)
 		self.aruco_dict_big  = aruco.getPredefinedDictionary(aruco.DICT_4X4_50)
 		self.parameters  = aruco.DetectorParameters_create()
+		#--- Reference bits of the big tags, to decode small tag candidates in single pass mode
+		self.big_tag_bits = self.dictionaryBits(self.aruco_dict_big)
+		self.single_pass = ac.ARUCO_SINGLE_PASS and self.big_tag_bits is not None
+		if ac.ARUCO_SINGLE_PASS and not self.single_pass:
+			print('ArUco dictionary bits not available, using two detection passes')
+
+###############################################################################
+
+	def dictionaryBits(self, dictionary):
+		#--- (n_markers, 4 rotations, markerSize^2) bits of a dictionary, None if not exposed
+		#--- bytesList holds the bytes of each rotation in turn, whatever shape the binding gives it,
+		#--- the bits packed row by row, MSB first, the last byte right aligned
+		try:
+			byte_list = np.asarray(dictionary.bytesList, dtype=np.uint8)
+			n_bits = dictionary.markerSize*dictionary.markerSize
+		except AttributeError:
+			return None
+		n_bytes = (n_bits + 7)//8
+		byte_list = byte_list.reshape(len(byte_list), 4, n_bytes)
+		bits = np.unpackbits(byte_list, axis=2)
+		tail = n_bits - 8*(n_bytes-1)
+		return np.concatenate((bits[:, :, :8*(n_bytes-1)], bits[:, :, 8*n_bytes-tail:]), axis=2)
+
+	def identifyBits(self, dictionary, dictionary_bits, inner):
+		#--- Same result as Dictionary.identify(): (found, id, rotation)
+		max_errors = int(dictionary.maxCorrectionBits*self.parameters.errorCorrectionRate)
+		distances = np.count_nonzero(dictionary_bits != inner.reshape(1, 1, -1), axis=2)
+		idx, rotation = np.unravel_index(np.argmin(distances), distances.shape)
+		return distances[idx, rotation] <= max_errors, int(idx), int(rotation)
 
 ###############################################################################
 
@@ -57,23 +90,86 @@ class Analyzer():
 ###############################################################################
 
 	def findAllArUcoTags(self, frame):
-		corners_small, ids_small, _ = aruco.detectMarkers(image=frame, 
-							dictionary=self.aruco_dict_small, parameters=self.parameters,
-							cameraMatrix=self.cam_matrix, distCoeff=self.cam_distortion)
-		corners_big, ids_big, _ = aruco.detectMarkers(image=frame, 
-							dictionary=self.aruco_dict_big, parameters=self.parameters,
-							cameraMatrix=self.cam_matrix, distCoeff=self.cam_distortion)
+		if self.single_pass:
+			#Candidates extracted once, the ones rejected as small tags decoded as big tags
+			corners_small, ids_small, rejected = aruco.detectMarkers(image=frame, 
+								dictionary=self.aruco_dict_small, parameters=self.parameters,
+								cameraMatrix=self.cam_matrix, distCoeff=self.cam_distortion)
+			corners_big, ids_big = self.decodeCandidates(frame, rejected, self.aruco_dict_big, self.big_tag_bits)
+		else:
+			corners_small, ids_small, _ = aruco.detectMarkers(image=frame, 
+								dictionary=self.aruco_dict_small, parameters=self.parameters,
+								cameraMatrix=self.cam_matrix, distCoeff=self.cam_distortion)
+			corners_big, ids_big, _ = aruco.detectMarkers(image=frame, 
+								dictionary=self.aruco_dict_big, parameters=self.parameters,
+								cameraMatrix=self.cam_matrix, distCoeff=self.cam_distortion)
 
-		if ac.TAG_NUMBER_LIMITED:
-			if len(corners_small) > ac.MAX_TAG_NUMBER:
-				corners_small = corners_small[:ac.MAX_TAG_NUMBER]
-				ids_small = ids_small[:ac.MAX_TAG_NUMBER]
-			if len(corners_big) > ac.MAX_TAG_NUMBER:
-				corners_big = corners_big[:ac.MAX_TAG_NUMBER]
-				ids_big = ids_big[:ac.MAX_TAG_NUMBER]
+		corners_small, ids_small = self.limitTags(corners_small, ids_small)
+		corners_big, ids_big = self.limitTags(corners_big, ids_big)
 
 		return corners_small, corners_big, ids_small, ids_big
 
+###############################################################################
+
+	def limitTags(self, corners, ids):
+		if ac.TAG_NUMBER_LIMITED and len(corners) > ac.MAX_TAG_NUMBER:
+			corners = corners[:ac.MAX_TAG_NUMBER]
+			ids = ids[:ac.MAX_TAG_NUMBER]
+		return corners, ids
+
+###############################################################################
+
+	def decodeCandidates(self, frame, candidates, dictionary, dictionary_bits):
+		#--- Identify candidate quads against another dictionary, the way detectMarkers
+		#--- does with its own: perspective removal, Otsu, bit sampling and identification
+		#--- Returns corners and ids with the detectMarkers layout (ids None if empty)
+		params = self.parameters
+		border = params.markerBorderBits
+		cells = dictionary.markerSize + 2*border
+		cell = params.perspectiveRemovePixelPerCell
+		side = cells*cell
+		margin = int(cell*params.perspectiveRemoveIgnoredMarginPerCell)
+		max_border_errors = int(dictionary.markerSize*dictionary.markerSize*params.maxErroneousBitsInBorderRate)
+		square = np.array([[0, 0], [side-1, 0], [side-1, side-1], [0, side-1]], dtype=np.float32)
+
+		corners = []
+		ids = []
+		centers = []
+		for candidate in candidates:
+			quad = candidate.reshape(4, 2).astype(np.float32)
+			transform = cv2.getPerspectiveTransform(quad, square)
+			marker = cv2.warpPerspective(frame, transform, (side, side), flags=cv2.INTER_NEAREST)
+			_, stddev = cv2.meanStdDev(marker)
+			if stddev[0][0] < params.minOtsuStdDev:
+				continue	# uniform patch, cannot be a marker
+			_, marker = cv2.threshold(marker, 125, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+			#--- Mean of every cell without its margins
+			cell_area = marker.reshape(cells, cell, cells, cell)[:, margin:cell-margin, :, margin:cell-margin]
+			bits = (cell_area.mean(axis=(1, 3)) > 127).astype(np.uint8)
+			inner = bits[border:cells-border, border:cells-border]
+			if int(bits.sum()) - int(inner.sum()) > max_border_errors:
+				continue
+			found, idx, rotation = self.identifyBits(dictionary, dictionary_bits, inner)
+			if not found:
+				continue
+			quad = np.roll(quad, rotation, axis=0)
+			center = quad.mean(axis=0)
+			if any(idx == i and np.linalg.norm(center-c) < cell for (i, c) in zip(ids, centers)):
+				continue	# same marker from a duplicated contour
+			corners.append(quad.reshape(1, 4, 2))
+			ids.append(idx)
+			centers.append(center)
+
+		if not ids:
+			return [], None
+		if params.cornerRefinementMethod == aruco.CORNER_REFINE_SUBPIX:
+			criteria = (cv2.TERM_CRITERIA_MAX_ITER | cv2.TERM_CRITERIA_EPS,
+						params.cornerRefinementMaxIterations, params.cornerRefinementMinAccuracy)
+			for quad in corners:
+				cv2.cornerSubPix(frame, quad.reshape(4, 1, 2), (params.cornerRefinementWinSize,
+							params.cornerRefinementWinSize), (-1, -1), criteria)
+		return corners, np.array(ids, dtype=np.int32).reshape(-1, 1)
+
 ###############################################################################
 
 	def poseAllArUcoTags(self, corners_small, corners_big, ids_small, ids_big):
@@ -97,5 +193,63 @@ class Analyzer():
 
 ###############################################################################
 
+	def submit(self, func, *args):
+		#--- Runs func on the worker pool, or right away without one
+		if self.pool is not None:
+			return self.pool.submit(func, *args)
+		future = Future()
+		future.set_result(func(*args))
+		return future
+
+	def timed(self, stage, func, *args):
+		start = time.time()
+		out = func(*args)
+		self.timings[stage] = time.time() - start
+		return out
+
+	def detectTags(self, frame, dictionary):
+		return aruco.detectMarkers(image=frame, 
+							dictionary=dictionary, parameters=self.parameters,
+							cameraMatrix=self.cam_matrix, distCoeff=self.cam_distortion)
+
+	def poseTags(self, corners, ids, tag_size):
+		if ids is None:
+			return None
+		return aruco.estimatePoseSingleMarkers(corners, tag_size, 
+						self.cam_matrix, self.cam_distortion)
+
+	def detectAndPoseTags(self, name, frame, dictionary, tag_size):
+		corners, ids, _ = self.timed('detect_' + name, self.detectTags, frame, dictionary)
+		corners, ids = self.limitTags(corners, ids)
+		return corners, ids, self.timed('pose_' + name, self.poseTags, corners, ids, tag_size)
 
+###############################################################################
 
+	def detectAndPoseAllArUcoTags(self, frame):
+		#--- findAllArUcoTags + poseAllArUcoTags with the independent work on the pool
+		#--- Returns corners_small, corners_big, ids_small, ids_big, ret_small, ret_big
+		self.timings = {}
+		start = time.time()
+		if self.single_pass:
+			#--- The big tags come from the small tag candidates, only the poses overlap
+			corners_small, ids_small, rejected = self.timed('detect_small', self.detectTags, frame, self.aruco_dict_small)
+			corners_small, ids_small = self.limitTags(corners_small, ids_small)
+			small = self.submit(self.timed, 'pose_small', self.poseTags, corners_small, ids_small, self.TAG_SIZE_SMALL)
+			corners_big, ids_big = self.timed('decode_big', self.decodeCandidates, frame, rejected, self.aruco_dict_big, self.big_tag_bits)
+			corners_big, ids_big = self.limitTags(corners_big, ids_big)
+			ret_big = self.timed('pose_big', self.poseTags, corners_big, ids_big, self.TAG_SIZE_BIG)
+			ret_small = small.result()
+		else:
+			small = self.submit(self.detectAndPoseTags, 'small', frame, self.aruco_dict_small, self.TAG_SIZE_SMALL)
+			corners_big, ids_big, ret_big = self.detectAndPoseTags('big', frame, self.aruco_dict_big, self.TAG_SIZE_BIG)
+			corners_small, ids_small, ret_small = small.result()
+		self.timings['total'] = time.time() - start
+
+		self.small_tags_detected = 0 if ids_small is None else len(ids_small)
+		self.big_tags_detected = 0 if ids_big is None else len(ids_big)
+		return corners_small, corners_big, ids_small, ids_big, ret_small, ret_big
+
+	def timingReport(self):
+		return '  '.join('%s=%.1fms' %(stage, 1000.0*t) for (stage, t) in sorted(self.timings.items()))
+
+###############################################################################
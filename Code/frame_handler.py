@@ -32,6 +32,14 @@ from model import Model
 from frame_analyzer import Analyzer
 import mbl_bots as ac
 
+#--- One row per tag seen in a frame, same columns as the frame_data lists
+FRAME_DATA_DTYPE = np.dtype([('frame', np.int32), ('x', np.float64), ('y', np.float64),
+			('z', np.float64), ('tita', np.float64), ('size', np.int32), ('id', np.int32),
+			('index', np.int32)])
+#--- Tag position in the camera frame, same columns as the measured_T_C lists
+MEASURED_T_C_DTYPE = np.dtype([('size', np.int32), ('id', np.int32), ('x', np.float64),
+			('y', np.float64), ('z', np.float64)])
+
 class Handler:
 
 	def __init__(self):
@@ -72,7 +80,11 @@ class Handler:
 		
 		measured_T_C = []
 
-		self.frame = cv2.cvtColor(self.original_frame, cv2.COLOR_BGR2GRAY)
+		if self.original_frame.ndim == 2:
+			#Already grayscale (Y plane from the camera)
+			self.frame = self.original_frame
+		else:
+			self.frame = cv2.cvtColor(self.original_frame, cv2.COLOR_BGR2GRAY)
 		# print(self.original_frame)
 		# print(' ')
 		# print(self.frame)
@@ -80,10 +92,13 @@ class Handler:
 		print('The Gray Scale frame from camera has size: {}x{}'.format(self.frame.shape[1],self.frame.shape[0]))
 		print(' ')
 
-		#-- Find all the aruco markers in the image
-		self.corners_small, self.corners_big, self.ids_small, self.ids_big = self.frame_analyzer.findAllArUcoTags(self.frame)
-		#-- Compute all poses from ids and corners
-		ret_small, ret_big = self.frame_analyzer.poseAllArUcoTags(self.corners_small, self.corners_big, self.ids_small, self.ids_big)
+		#-- Find all the aruco markers in the image and compute their poses
+		(self.corners_small, self.corners_big, self.ids_small, self.ids_big,
+			ret_small, ret_big) = self.frame_analyzer.detectAndPoseAllArUcoTags(self.frame)
+		print('ArUco timings: ' + self.frame_analyzer.timingReport())
+
+		if ac.BATCHED_FRAME_PROCESSING:
+			return self.processTagsBatch(ret_small, ret_big)
 		
 		try:
 			if ret_small is not None:
@@ -157,6 +172,109 @@ class Handler:
 
 		return self.frame_data, confi_vector
 
+###############################################################################
+
+	def poseTagsBatch(self, size_code, ids, ret):
+		#--- Camera and world poses of all the detected tags of one size at once
+		#--- Returns the frame_data and measured_T_C rows as record arrays
+		ids = np.asarray(ids, dtype=np.int32).reshape(-1)
+		rvecs = np.asarray(ret[0]).reshape(-1, 3)
+		tvecs = np.asarray(ret[1]).reshape(-1, 3)
+		valid = self.model.getTagMask(ids, size_code)
+		if not valid.all():
+			print('Tags not in the arena ignored: {}'.format(ids[~valid]))
+			ids, rvecs, tvecs = ids[valid], rvecs[valid], tvecs[valid]
+		indices = self.model.getIndex(ids.astype(np.int64), size_code)
+		T_T_C = self.model.getT_T_C_batch(rvecs, tvecs)
+		T_ABS_ROBOT = self.model.getT_ABS_ROBOT_batch(indices, rvecs, tvecs, T_T_C)
+
+		data = np.zeros(len(ids), dtype=FRAME_DATA_DTYPE)
+		data['frame'] = self.frame_number
+		data['x'] = T_ABS_ROBOT[:, 0, 3]
+		data['y'] = T_ABS_ROBOT[:, 1, 3]
+		data['z'] = T_ABS_ROBOT[:, 2, 3]
+		data['tita'] = np.arctan2(T_ABS_ROBOT[:, 1, 0], T_ABS_ROBOT[:, 0, 0])
+		data['size'] = size_code
+		data['id'] = ids
+		data['index'] = indices
+
+		measured = np.zeros(len(ids), dtype=MEASURED_T_C_DTYPE)
+		measured['size'] = size_code
+		measured['id'] = ids
+		measured['x'] = T_T_C[:, 0, 3]
+		measured['y'] = T_T_C[:, 1, 3]
+		measured['z'] = T_T_C[:, 2, 3]
+		return data, measured
+
+###############################################################################
+
+	def processTagsBatch(self, ret_small, ret_big):
+		#--- Vectorized version of the per tag loop of processFrame
+		#--- Returns the frame data as a FRAME_DATA_DTYPE record array and the confi vector
+		data = [np.zeros(0, dtype=FRAME_DATA_DTYPE)]
+		measured = [np.zeros(0, dtype=MEASURED_T_C_DTYPE)]
+		if ret_small is not None:
+			self.rvec_small, self.tvec_small = ret_small[0], ret_small[1]
+			small_data, small_measured = self.poseTagsBatch(ac.SMALL_TAG_CODE, self.ids_small, ret_small)
+			data.append(small_data)
+			measured.append(small_measured)
+		if ret_big is not None:
+			self.rvec_big, self.tvec_big = ret_big[0], ret_big[1]
+			big_data, big_measured = self.poseTagsBatch(ac.BIG_TAG_CODE, self.ids_big, ret_big)
+			data.append(big_data)
+			measured.append(big_measured)
+		data = np.concatenate(data).view(np.recarray)
+		measured = np.concatenate(measured)
+
+		print('TAGS DETECTED IN FRAME {}: {} small, {} big'.format(self.frame_number,
+				int(np.sum(data['size'] == ac.SMALL_TAG_CODE)), int(np.sum(data['size'] == ac.BIG_TAG_CODE))))
+		if len(data) == 0:
+			self.without_tag_frame_number += 1
+			print('NO TAGS DETECTED IN FRAME {}'.format(self.frame_number))
+			data = np.array([(self.frame_number, 0.0, 0.0, 0.0, 0.0, 2, 999, 999)],
+						dtype=FRAME_DATA_DTYPE).view(np.recarray)
+		self.tag_number_history.append([len(measured)])
+
+		if ac.WRITE_LOG_FILE:
+			for row in data[data['size'] != 2]:
+				self.log.write('\t (%d){%d}[%d]-- x=%4.2f y=%4.2f tita=%4.2f \r' %(row['size'], row['index'], row['id'], row['x'], row['y'], math.degrees(row['tita'])))
+
+		self.frame_data = data
+		confi_vector = self.process_T_C_batch(measured)
+		if confi_vector is None:
+			print('error creating CONFI_VECTOR')
+
+		return self.frame_data, confi_vector
+
+###############################################################################
+
+	def process_T_C_batch(self, measured):
+		#--- process_T_C_data for a MEASURED_T_C_DTYPE array, with array operations
+		if len(measured) < 1:
+			print('No measured TC')
+			self.real_dist_submatrix = None
+			return None
+
+		#--- Big tags first, then small tags, each sorted by id
+		measured = measured[np.lexsort((measured['id'], measured['size'] != ac.BIG_TAG_CODE))]
+		ids = measured['id'].astype(np.int64)
+		r_matrix_ids = np.where(measured['size'] == ac.BIG_TAG_CODE,
+					self.model.getIndex(ids, ac.BIG_TAG_CODE), self.model.getIndex(ids, ac.SMALL_TAG_CODE))
+
+		x = measured['x'].astype(np.float32)
+		m_matrix = np.abs(x[:, None] - x[None, :])
+		r_matrix = self.model.dist_matrix[np.ix_(r_matrix_ids, r_matrix_ids)]
+
+		n = len(r_matrix_ids)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			dist_matrix = np.abs(m_matrix-r_matrix)/r_matrix
+			confi_matrix = np.asarray(1/np.cosh(5*dist_matrix), dtype=np.float32)
+			#--- Mean confidence against the other tags, without the diagonal
+			np.fill_diagonal(confi_matrix, 0.0)
+			confi = confi_matrix.sum(axis=1)/np.float32(n-1)
+
+		return dict(zip(map(str, r_matrix_ids.tolist()), confi))
+
 ###############################################################################
 
 	def process_T_C_data(self, measured_T_C):
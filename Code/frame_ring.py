@@ -0,0 +1,201 @@
+import time
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import mbl_bots
+from camera import Cam, frameLayout
+
+#Header fields (int64)
+LATEST_SEQ = 0
+LATEST_SLOT = 1
+READING_SLOT = 2
+HEADER_FIELDS = 3
+
+
+class FrameRing(object):
+	"""Ring of fixed size frame slots in shared memory, one writer and one reader.
+
+	The block holds an int64 header (latest sequence number, latest slot,
+	slot held by the reader), the sequence number and timestamp of every
+	slot, and then the raw frames. A slot's sequence number is -1 while it
+	is being written. The writer never takes the latest slot nor the one the
+	reader holds, so the reader works on views of the shared frames
+	without copying or pickling them.
+	"""
+	def __init__(self, resolution, slots=mbl_bots.CAPTURE_RING_SLOTS, format=mbl_bots.CAPTURE_FORMAT, name=None):
+		super(FrameRing, self).__init__()
+		if slots < 3:
+			raise ValueError('A frame ring needs at least 3 slots')
+		(self.frameBytes, view) = frameLayout(format, resolution)
+		self.slots = slots
+		headerBytes = 8*(HEADER_FIELDS + 2*slots)
+		self.owner = name is None
+		if self.owner:
+			self.shm = shared_memory.SharedMemory(create=True, size=headerBytes + slots*self.frameBytes)
+		else:
+			self.shm = shared_memory.SharedMemory(name=name)
+		buf = self.shm.buf
+		self.header = np.ndarray(HEADER_FIELDS, np.int64, buf, 0)
+		self.seqs = np.ndarray(slots, np.int64, buf, 8*HEADER_FIELDS)
+		self.times = np.ndarray(slots, np.float64, buf, 8*(HEADER_FIELDS + slots))
+		self.data = np.ndarray((slots, self.frameBytes), np.uint8, buf, headerBytes)
+		self.frames = [view(self.data[k]) for k in range(slots)]
+		if self.owner:
+			self.header[:] = (0, -1, -1)
+			self.seqs[:] = 0
+		self.writeSlot = 0
+
+	@property
+	def name(self):
+		return self.shm.name
+
+	def begin(self):
+		#Writer: claims a free slot and returns its flat buffer
+		for i in range(1, self.slots+1):
+			k = (self.writeSlot + i) % self.slots
+			if k == self.header[LATEST_SLOT]:
+				continue
+			old = self.seqs[k]
+			self.seqs[k] = -1
+			#Checked after marking the slot, the reader checks in the opposite order
+			if self.header[READING_SLOT] != k:
+				break
+			self.seqs[k] = old
+		self.writeSlot = k
+		return self.data[k]
+
+	def publish(self, timestamp):
+		#Writer: the claimed slot holds a complete frame
+		k = self.writeSlot
+		seq = self.header[LATEST_SEQ] + 1
+		self.times[k] = timestamp
+		self.seqs[k] = seq
+		self.header[LATEST_SLOT] = k
+		self.header[LATEST_SEQ] = seq
+
+	def acquire(self, newerThan=0, timeout=None, pollTime=mbl_bots.CAPTURE_POLL_TIME):
+		#Reader: (frame, timestamp, seq) of the latest frame with seq > newerThan, None on timeout.
+		#The frame stays untouched until the next acquire.
+		deadline = None if timeout is None else time.monotonic() + timeout
+		while True:
+			seq = int(self.header[LATEST_SEQ])
+			if seq > newerThan:
+				k = int(self.header[LATEST_SLOT])
+				self.header[READING_SLOT] = k
+				if self.seqs[k] == seq:
+					return self.frames[k], float(self.times[k]), seq
+				continue
+			if deadline is not None and time.monotonic() > deadline:
+				return None
+			time.sleep(pollTime)
+
+	def close(self):
+		self.frames = None
+		self.header = self.seqs = self.times = self.data = None
+		try:
+			self.shm.close()
+		except BufferError:
+			#A reader still holds a frame view, the mapping goes with it
+			pass
+		if self.owner:
+			self.shm.unlink()
+
+
+class RingOutput(object):
+	"""File-like picamera output writing each frame into a FrameRing slot"""
+	def __init__(self, ring):
+		super(RingOutput, self).__init__()
+		self.ring = ring
+		self.slot = memoryview(ring.begin())
+		self.pos = 0
+
+	def write(self, data):
+		n = len(data)
+		end = min(self.pos+n, self.ring.frameBytes)
+		self.slot[self.pos:end] = data[:end-self.pos]
+		self.pos = end
+		if self.pos == self.ring.frameBytes:
+			self.ring.publish(time.monotonic())
+			self.slot = memoryview(self.ring.begin())
+			self.pos = 0
+		return n
+
+	def flush(self):
+		pass
+
+
+def runCapture(name, resolution, slots, format, stop, commands):
+	#Capture process: camera frames into the shared ring until stop is set
+	ring = FrameRing(resolution, slots, format, name)
+	cam = Cam()
+	output = RingOutput(ring)
+	for frame in cam.camera.capture_continuous(output, format=format, use_video_port=True):
+		if stop.is_set():
+			break
+		while commands.poll():
+			(command, arg) = commands.recv()
+			if command == "pic":
+				cam.takePic(arg)
+	output.slot.release()
+	cam.camera.close()
+	ring.close()
+
+
+class CaptureProcess(object):
+	"""Drop-in for Cam that captures in a separate process.
+
+	Frames arrive through a FrameRing, so capture and analysis run on
+	different cores and the frames are never pickled. The process is
+	spawned rather than forked, the robot already runs several threads.
+	It starts with startCapture() or with the first frame request.
+	"""
+	def __init__(self, resolution=mbl_bots.CAPTURE_RESOLUTION, slots=mbl_bots.CAPTURE_RING_SLOTS,
+				format=mbl_bots.CAPTURE_FORMAT):
+		super(CaptureProcess, self).__init__()
+		self.ring = FrameRing(resolution, slots, format)
+		context = multiprocessing.get_context("spawn")
+		self.stopEvent = context.Event()
+		(self.commands, child) = context.Pipe()
+		self.process = context.Process(target=runCapture,
+					args=(self.ring.name, resolution, slots, format, self.stopEvent, child))
+		self.process.daemon = True
+		self.capturing = False
+		self.lastSeq = 0
+		self.frame = None
+
+	def startCapture(self, n_buffers=None):
+		if self.capturing:
+			return
+		if self.process.pid is not None:
+			raise IOError('The capture process was stopped')
+		self.process.start()
+		self.capturing = True
+
+	def stopCapture(self):
+		if self.capturing:
+			self.stopEvent.set()
+			self.process.join()
+			self.capturing = False
+			self.frame = None
+			self.ring.close()
+
+	def getLatestFrame(self, newerThan=0, timeout=mbl_bots.CAPTURE_TIMEOUT):
+		#(frame, timestamp, seq) from the capture process, None on timeout.
+		#The process starts with the first frame request if nobody started it
+		self.startCapture()
+		return self.ring.acquire(newerThan, timeout)
+
+	def getFrame(self):
+		timeout = mbl_bots.CAPTURE_START_TIMEOUT if self.lastSeq == 0 else mbl_bots.CAPTURE_TIMEOUT
+		latest = self.getLatestFrame(self.lastSeq, timeout)
+		if latest is None:
+			raise IOError('No frame from the capture process')
+		(self.frame, timestamp, self.lastSeq) = latest
+		return self.frame
+
+	def truncateFrame(self):
+		pass
+
+	def takePic(self, output_dir="./Captures/"):
+		#Taken by the capture process, which owns the camera
+		self.commands.send(("pic", output_dir))
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+	File: frame_source.py
+
+	Frame sources for the vision stack of the LoCo_benchmark project: the live
+	camera, video files, directories of images and arrays held in memory, all
+	with the same sequential and random access interface.
+"""
+
+__author__ = "Manuel Bernal"
+__credits__ = ["Manuel Bernal", "Ignacio Cuiral", "Javier Antoran",
+                    "Javier Civera"]
+__license__ = "GPLv3"
+__version__ = "1.0.1"
+__maintainer__ = "Manuel Bernal"
+__email__ = "mbl@unizar.es"
+__status__ = "Prototype"
+
+
+import cv2
+import numpy as np
+
+import os, glob, time, threading, queue
+
+import mbl_bots as ac
+
+
+class FrameSource():
+	"""Base class of the frame sources.
+
+	read() returns (frame, timestamp, index) for the next frame, or None
+	at the end. seek() moves to any frame and get(i) is seek(i) + read().
+	"""
+
+	def __init__(self, gray=True):
+		self.gray = gray
+		self.index = 0
+
+	def length(self):
+		#Number of frames, None when unknown (live camera, raw h264 streams)
+		return None
+
+	def read(self):
+		raise NotImplementedError
+
+	def seek(self, index):
+		raise NotImplementedError
+
+	def get(self, index):
+		self.seek(index)
+		return self.read()
+
+	def toGray(self, frame):
+		if self.gray and frame.ndim == 3:
+			return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+		return frame
+
+	def __iter__(self):
+		while True:
+			item = self.read()
+			if item is None:
+				return
+			yield item
+
+	def close(self):
+		pass
+
+###############################################################################
+
+class CameraSource(FrameSource):
+	"""Live frames from a Cam, indexed by capture sequence number"""
+
+	def __init__(self, cam):
+		FrameSource.__init__(self, gray=False)
+		self.cam = cam
+
+	def read(self):
+		if self.cam.capturing:
+			latest = self.cam.getLatestFrame(self.index)
+			if latest is None:
+				return None
+			(frame, timestamp, self.index) = latest
+			return frame, timestamp, self.index
+		frame = self.cam.getFrame()
+		self.cam.truncateFrame()
+		self.index += 1
+		return frame, time.monotonic(), self.index
+
+	def seek(self, index):
+		raise ValueError('A live camera cannot seek')
+
+###############################################################################
+
+class IndexedSource(FrameSource):
+	"""Sources that can load any frame directly: load(i) and count"""
+
+	def __init__(self, count, fps=ac.REPLAY_FPS, gray=True):
+		FrameSource.__init__(self, gray)
+		self.count = count
+		self.fps = fps
+
+	def length(self):
+		return self.count
+
+	def load(self, index):
+		raise NotImplementedError
+
+	def read(self):
+		if self.index >= self.count:
+			return None
+		index = self.index
+		self.index += 1
+		return self.load(index), index/self.fps, index
+
+	def seek(self, index):
+		if not 0 <= index <= self.count:
+			raise IndexError('Frame {} out of range'.format(index))
+		self.index = index
+
+
+class ArraySource(IndexedSource):
+	"""Frames from an (n, h, w[, 3]) array or a list of arrays"""
+
+	def __init__(self, frames, fps=ac.REPLAY_FPS, gray=True):
+		IndexedSource.__init__(self, len(frames), fps, gray)
+		self.frames = frames
+
+	def load(self, index):
+		return self.toGray(self.frames[index])
+
+
+class ImageDirSource(IndexedSource):
+	"""Frames from the image files of a directory, in name order"""
+
+	def __init__(self, path, fps=ac.REPLAY_FPS, gray=True, patterns=ac.REPLAY_IMAGE_PATTERNS):
+		files = []
+		for pattern in patterns:
+			files.extend(glob.glob(os.path.join(path, pattern)))
+		self.files = sorted(set(files))
+		IndexedSource.__init__(self, len(self.files), fps, gray)
+
+	def load(self, index):
+		flags = cv2.IMREAD_GRAYSCALE if self.gray else cv2.IMREAD_COLOR
+		frame = cv2.imread(self.files[index], flags)
+		if frame is None:
+			raise IOError('Cannot read ' + self.files[index])
+		return frame
+
+###############################################################################
+
+class VideoSource(FrameSource):
+	"""Frames from a video file (mp4, or raw h264 as written by Cam.startVideo)
+
+	Containers with an index seek directly. Raw h264 streams have neither
+	an index nor a frame count, so seeking reopens the file and skips
+	frames with grab(), which does not decode them to images.
+	"""
+
+	def __init__(self, path, fps=None, gray=True):
+		FrameSource.__init__(self, gray)
+		self.path = path
+		self.capture = None
+		self.open()
+		if fps is None:
+			fps = self.capture.get(cv2.CAP_PROP_FPS)
+		self.fps = fps if fps and fps > 0 else ac.REPLAY_FPS
+		count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+		self.count = count if count > 0 else None
+
+	def open(self):
+		if self.capture is not None:
+			self.capture.release()
+		self.capture = cv2.VideoCapture(self.path)
+		if not self.capture.isOpened():
+			raise IOError('Cannot open ' + self.path)
+		self.index = 0
+
+	def length(self):
+		return self.count
+
+	def read(self):
+		ok, frame = self.capture.read()
+		if not ok:
+			return None
+		index = self.index
+		self.index += 1
+		return self.toGray(frame), index/self.fps, index
+
+	def seek(self, index):
+		if index == self.index:
+			return
+		if self.count is not None and self.capture.set(cv2.CAP_PROP_POS_FRAMES, index):
+			self.index = index
+			return
+		if index < self.index:
+			self.open()
+		while self.index < index:
+			if not self.capture.grab():
+				raise IndexError('Frame {} out of range'.format(index))
+			self.index += 1
+
+	def close(self):
+		self.capture.release()
+
+###############################################################################
+
+class ReadAhead(FrameSource):
+	"""Reads the frames of another source in a background thread.
+
+	Decoding the next frames overlaps with the processing of the current
+	one. Seeking drops the queued frames and restarts the reader at the
+	new position. Errors of the source are raised by read(), in order.
+	"""
+
+	def __init__(self, source, depth=ac.REPLAY_READ_AHEAD):
+		FrameSource.__init__(self, source.gray)
+		self.source = source
+		self.depth = depth
+		self.queue = None
+		self.thread = None
+		self.running = threading.Event()
+		self.start()
+
+	def length(self):
+		return self.source.length()
+
+	def start(self):
+		self.queue = queue.Queue(self.depth)
+		self.running.set()
+		self.thread = threading.Thread(target=self.run, args=(self.queue,))
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		self.running.clear()
+		if self.thread is not None:
+			#Unblock the reader if the queue is full
+			while self.thread.is_alive():
+				try:
+					self.queue.get(timeout=0.01)
+				except queue.Empty:
+					pass
+			self.thread = None
+
+	def run(self, frames):
+		while self.running.is_set():
+			try:
+				item = self.source.read()
+			except Exception as e:
+				#Handed to the consumer, raised again by read()
+				frames.put(e)
+				return
+			frames.put(item)
+			if item is None:
+				return
+
+	def read(self):
+		if self.thread is None:
+			return None
+		item = self.queue.get()
+		if isinstance(item, Exception):
+			self.thread = None
+			raise item
+		if item is None:
+			self.thread = None
+		else:
+			self.index = item[2] + 1
+		return item
+
+	def seek(self, index):
+		self.stop()
+		self.source.seek(index)
+		self.index = index
+		self.start()
+
+	def close(self):
+		self.stop()
+		self.source.close()
+
+###############################################################################
+
+def openSource(source, gray=True, readAhead=ac.REPLAY_READ_AHEAD):
+	#Frame source for an array stack, an image directory or a video file
+	if isinstance(source, (np.ndarray, list, tuple)):
+		return ArraySource(source, gray=gray)
+	if os.path.isdir(source):
+		frames = ImageDirSource(source, gray=gray)
+	else:
+		frames = VideoSource(source, gray=gray)
+	if readAhead:
+		return ReadAhead(frames, readAhead)
+	return frames
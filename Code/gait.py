@@ -0,0 +1,87 @@
+from collections import OrderedDict
+import numpy as np
+import mbl_bots
+from trajectory import Trajectory
+
+
+class GaitGenerator(object):
+	"""Generates walking cycles from gait parameters instead of movefiles.
+
+	Legs are handled in the order FL, FR, BL, BR. Each leg has a shoulder
+	servo (S) that yaws the leg around the vertical axis and a leg servo (L)
+	that lifts the foot. Feet follow a step of the given length along the
+	heading while on the ground (stance) and return through the air (swing),
+	and the joint angles come from the closed-form inverse kinematics of
+	that 2-DOF leg, evaluated for all legs and samples in one go.
+	"""
+	def __init__(self, acc_table, rate=mbl_bots.TRAJ_RATE, cacheSize=mbl_bots.TRAJ_CACHE_SIZE):
+		super(GaitGenerator, self).__init__()
+		self.period = 1.0/rate
+		self.cacheSize = cacheSize
+		self.cache = OrderedDict()
+
+		self.acc_table = acc_table
+		self.idx = acc_table.indices(mbl_bots.GAIT_SHOULDERS + mbl_bots.GAIT_LEGS)
+		self.channels = tuple(acc_table.channel[self.idx].tolist())
+
+		self.hip = np.asarray(mbl_bots.GAIT_HIP_XY, dtype=np.float64)
+		self.direction = np.radians(mbl_bots.GAIT_LEG_DIRECTION)
+		#Neutral foot positions in body frame (4, 2)
+		self.foot = self.hip + mbl_bots.GAIT_FOOT_RADIUS*np.stack(
+			(np.cos(self.direction), np.sin(self.direction)), axis=1)
+		self.shoulderCenter = np.asarray(mbl_bots.GAIT_SHOULDER_CENTER, dtype=np.float64)
+		self.legCenter = np.asarray(mbl_bots.GAIT_LEG_CENTER, dtype=np.float64)
+		self.legSign = np.asarray(mbl_bots.GAIT_LEG_SIGN, dtype=np.float64)
+		self.phase = np.asarray(mbl_bots.GAIT_PHASE, dtype=np.float64)
+
+	def footTrajectory(self, t, cycleTime, stepLength, stepHeight, heading, dutyFactor, turn):
+		#Foot displacement (N, 4, 2) and height (N, 4) for sample times t (N,)
+		u = np.mod(t[:, None]/cycleTime + self.phase[None, :], 1.0)
+		stance = u < dutyFactor
+		#Progress along the step: +1/2 --> -1/2 on stance, back on swing
+		us = np.where(stance, u/dutyFactor, (u-dutyFactor)/(1.0-dutyFactor))
+		s = np.where(stance, 0.5-us, us-0.5)
+		h = np.where(stance, 0.0, stepHeight*np.sin(np.pi*us))
+
+		#Per-leg step vector: translation along heading plus rotation around the body centre
+		h_rad = np.radians(heading)
+		step = stepLength*np.array([np.cos(h_rad), np.sin(h_rad)])
+		t_rad = np.radians(turn)
+		step = step[None, :] + t_rad*np.stack((-self.foot[:, 1], self.foot[:, 0]), axis=1)
+		return s[:, :, None]*step[None, :, :], h
+
+	def inverseKinematics(self, disp, height):
+		#Shoulder yaw from the foot direction, leg lift from the foot height
+		p = self.foot[None, :, :] + disp - self.hip[None, :, :]
+		yaw = np.degrees(np.arctan2(p[:, :, 1], p[:, :, 0]) - self.direction[None, :])
+		yaw = (yaw+180.0) % 360.0 - 180.0
+		lift = np.degrees(np.arcsin(np.clip(height/mbl_bots.GAIT_LEG_LENGTH, -1.0, 1.0)))
+		shoulder = self.shoulderCenter[None, :] + yaw
+		leg = self.legCenter[None, :] + self.legSign[None, :]*lift
+		return np.concatenate((shoulder, leg), axis=1)
+
+	def build(self, stepLength, stepHeight, heading, dutyFactor, turn, cycleTime):
+		t = np.arange(0.0, cycleTime-0.5*self.period, self.period)
+		disp, height = self.footTrajectory(t, cycleTime, stepLength, stepHeight, heading, dutyFactor, turn)
+		angles = self.inverseKinematics(disp, height)
+		counts = self.acc_table.pose2counts(angles, self.idx)
+
+		#Trajectory channels go in ascending order for the block writes
+		order = np.argsort(self.channels)
+		channels = tuple(self.channels[i] for i in order)
+		return Trajectory('gait', channels, self.period, counts[:, order], periodic=True)
+
+	def cycle(self, stepLength=mbl_bots.GAIT_STEP_LENGTH, stepHeight=mbl_bots.GAIT_STEP_HEIGHT,
+			heading=0.0, dutyFactor=mbl_bots.GAIT_DUTY_FACTOR, turn=0.0, cycleTime=mbl_bots.GAIT_CYCLE_TIME):
+		#Parameters are rounded so continuous control reuses cached cycles
+		key = (round(stepLength, 1), round(stepHeight, 1), round(heading) % 360,
+				round(dutyFactor, 2), round(turn), round(cycleTime, 2))
+		traj = self.cache.get(key)
+		if traj is None:
+			traj = self.build(*key)
+			self.cache[key] = traj
+			if len(self.cache) > self.cacheSize:
+				self.cache.popitem(last=False)
+		else:
+			self.cache.move_to_end(key)
+		return traj
@@ -0,0 +1,69 @@
+import os
+import sys
+import numpy as np
+import mbl_bots
+
+
+class ImuCalibration(object):
+	"""Per-axis bias and scale of the IMU, for [Ax,Ay,Az,Gx,Gy,Gz] samples.
+
+	A corrected sample is (data - bias) * scale, applied to whole blocks
+	at once. The file holds the bias row and the scale row, comma separated
+	like the camera calibration files.
+	"""
+	def __init__(self, bias=None, scale=None):
+		super(ImuCalibration, self).__init__()
+		self.bias = np.zeros(6) if bias is None else np.asarray(bias, dtype=np.float64)
+		self.scale = np.ones(6) if scale is None else np.asarray(scale, dtype=np.float64)
+
+	def apply(self, data):
+		return (data - self.bias)*self.scale
+
+	def estimateStationary(self, batch, gravityAxis=2):
+		#batch (n, 6) taken with the robot still and gravityAxis pointing up
+		mean = np.mean(batch, axis=0)
+		self.bias = mean.copy()
+		self.bias[gravityAxis] -= 1.0
+		self.scale = np.ones(6)
+		return self
+
+	def estimateSixFaces(self, batches):
+		#batches: stationary (n, 6) arrays covering every accel axis up and down
+		means = np.array([np.mean(b, axis=0) for b in batches])
+		up = np.argmax(means[:, 0:3], axis=0)
+		down = np.argmin(means[:, 0:3], axis=0)
+		axes = np.arange(3)
+		plus = means[up, axes]
+		minus = means[down, axes]
+		self.bias = np.zeros(6)
+		self.scale = np.ones(6)
+		self.bias[0:3] = (plus+minus)/2.0
+		self.scale[0:3] = 2.0/(plus-minus)
+		#Gyro bias from every batch, the robot is still in all of them
+		self.bias[3:6] = np.mean(means[:, 3:6], axis=0)
+		return self
+
+	def save(self, path=None):
+		if path is None:
+			path = os.path.join(mbl_bots.CALIBRATION_PATH, mbl_bots.IMU_CALIBRATION_FILE)
+		np.savetxt(path, np.vstack((self.bias, self.scale)), delimiter=',')
+
+	@staticmethod
+	def load(path=None):
+		#Returns None when there is no calibration file
+		if path is None:
+			path = os.path.join(mbl_bots.CALIBRATION_PATH, mbl_bots.IMU_CALIBRATION_FILE)
+		if not os.path.isfile(path):
+			return None
+		values = np.loadtxt(path, delimiter=',')
+		return ImuCalibration(values[0], values[1])
+
+
+if __name__=='__main__':
+	#Stationary calibration: keep the robot still and flat while it runs
+	from bus_backend import openBus
+	from IMU import IMU
+	n = int(sys.argv[1]) if len(sys.argv) > 1 else mbl_bots.IMU_CALIBRATION_SAMPLES
+	imu = IMU(openBus(mbl_bots.BUS_BACKEND, mbl_bots.I2C_BUS))
+	calibration = imu.calibrate(n)
+	print("IMU bias: {}".format(calibration.bias))
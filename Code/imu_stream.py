@@ -0,0 +1,141 @@
+import time
+import threading
+import logging
+import numpy as np
+import mbl_bots
+
+
+class SampleRing(object):
+	"""Preallocated ring of timestamped IMU samples.
+
+	Every sample is stored twice, at i and i+capacity, so the latest n
+	samples are always contiguous in memory and last(n) returns views
+	instead of copies.
+	"""
+	def __init__(self, capacity=mbl_bots.IMU_RING_SIZE, width=6):
+		super(SampleRing, self).__init__()
+		self.capacity = capacity
+		self.data = np.zeros((2*capacity, width), dtype=np.float64)
+		self.times = np.zeros(2*capacity, dtype=np.float64)
+		self.head = 0		#next write position
+		self.total = 0		#samples written since creation
+		self.lock = threading.Lock()
+
+	def push(self, times, data):
+		n = len(times)
+		if n > self.capacity:
+			times = times[-self.capacity:]
+			data = data[-self.capacity:]
+			self.total += n-self.capacity
+			n = self.capacity
+		with self.lock:
+			first = min(n, self.capacity-self.head)
+			for (a, b) in ((0, first), (first, n)):
+				if a == b: continue
+				pos = (self.head+a) % self.capacity
+				self.data[pos:pos+b-a] = data[a:b]
+				self.data[pos+self.capacity:pos+self.capacity+b-a] = data[a:b]
+				self.times[pos:pos+b-a] = times[a:b]
+				self.times[pos+self.capacity:pos+self.capacity+b-a] = times[a:b]
+			self.head = (self.head+n) % self.capacity
+			self.total += n
+
+	def __len__(self):
+		return min(self.total, self.capacity)
+
+	def last(self, n):
+		#(times, data) views of the latest n samples, oldest first
+		n = min(n, len(self))
+		end = self.head + self.capacity
+		return self.times[end-n:end], self.data[end-n:end]
+
+	def since(self, t):
+		#Views of the samples newer than t
+		times, data = self.last(self.capacity)
+		first = np.searchsorted(times, t, side='right')
+		return times[first:], data[first:]
+
+
+class ImuStream(threading.Thread):
+	"""Streams the MPU6050 FIFO into a SampleRing from a background thread.
+
+	The FIFO is drained in bulk every IMU_POLL_TIME seconds. Samples are
+	timestamped backwards from the drain time at the configured sample
+	period, and the ring keeps them as [Ax,Ay,Az,Gx,Gy,Gz] like
+	IMU.getImuRawData. Listeners get every new block as (times, data).
+	"""
+	def __init__(self, imu, rate=mbl_bots.IMU_STREAM_RATE, capacity=mbl_bots.IMU_RING_SIZE,
+				pollTime=mbl_bots.IMU_POLL_TIME, clock=time.monotonic):
+		super(ImuStream, self).__init__()
+		self.daemon = True
+		self.imu = imu
+		self.rate = rate
+		self.pollTime = pollTime
+		self.clock = clock
+		self.ring = SampleRing(capacity)
+		self.listeners = []
+		self.running = threading.Event()
+		self.overflows = 0
+		self.lastTime = None
+
+	def addListener(self, callback):
+		self.listeners.append(callback)
+
+	def start(self):
+		self.rate = self.imu.setSampleRate(self.rate)
+		self.imu.streaming = True
+		self.imu.enableFifo()
+		self.running.set()
+		super(ImuStream, self).start()
+
+	def stop(self):
+		self.running.clear()
+		if self.is_alive():
+			self.join()
+		self.imu.disableFifo()
+		self.imu.streaming = False
+
+	def drain(self):
+		if self.imu.fifoOverflow():
+			#Samples were lost: restart the FIFO and the timeline
+			self.overflows += 1
+			logging.debug('IMU FIFO overflow, resetting')
+			self.imu.resetFifo()
+			self.lastTime = None
+			return 0
+		n = self.imu.fifoCount()//14
+		if n == 0:
+			return 0
+		now = self.clock()
+		raw = self.imu.readFifo(n)
+		period = 1.0/self.rate
+		times = now - period*np.arange(n-1, -1, -1)
+		if self.lastTime is not None:
+			#Keep timestamps monotonic when the drain time jitters
+			times = np.maximum(times, self.lastTime + period*np.arange(1, n+1))
+		self.lastTime = times[-1]
+		data = self.imu.raw2data(raw)
+		self.ring.push(times, data)
+		for callback in self.listeners:
+			callback(times, data)
+		return n
+
+	def run(self):
+		while self.running.is_set():
+			start = self.clock()
+			try:
+				self.drain()
+			except IOError:
+				logging.debug('IMU FIFO read failed')
+			remaining = self.pollTime - (self.clock()-start)
+			if remaining > 0.0:
+				time.sleep(remaining)
+
+	def latest(self):
+		times, data = self.ring.last(1)
+		if len(times) == 0:
+			return None
+		return data[0]
+
+	def window(self, n):
+		return self.ring.last(n)
@@ -1,5 +1,7 @@
 #SETUP FILES
 ROBOTFILE = 'LoCoQuad.botfile.txt'
+MOVEFILE_PREFIX = 'LoCoQuad_'
+MOVEFILE_SUFFIX = '.movefile.txt'
 
 #Actuators or Sensors
 ACC = 0
@@ -17,6 +19,50 @@ SPEED_FACTOR = 10.0
 SCALE_ACC = 11
 CNT_ACC = 500
 
+#Servo PWM timing (PCA9685 at 50Hz, 12-bit counter)
+PWM_FREQ = 50
+PWM_PERIOD_US = 20000
+PWM_RESOLUTION = 4096
+PWM_CHANNELS = 16
+
+#MOVE PLAYER
+#A move starting less than this after the previous one ended keeps its timeline [s]
+PLAYER_CHAIN_TIME = 0.05
+#Lateness histogram edges [ms]
+PLAYER_JITTER_BINS = [0.5, 1, 2, 5, 10, 20, 50]
+
+#TRAJECTORY INTERPOLATION
+#Control rate of interpolated moves [Hz]
+TRAJ_RATE = 50
+#Default profile: 'linear', 'cubic' or 'minjerk'
+TRAJ_PROFILE = 'minjerk'
+TRAJ_CACHE_SIZE = 32
+
+#GAIT GENERATOR
+#Legs in order FL, FR, BL, BR
+GAIT_SHOULDERS = ['FSL', 'FSR', 'BSL', 'BSR']
+GAIT_LEGS = ['FLL', 'FLR', 'BLL', 'BLR']
+#Hip positions in body frame, x forward, y left [cm]
+GAIT_HIP_XY = [[4.5, 4.0], [4.5, -4.0], [-4.5, 4.0], [-4.5, -4.0]]
+#Neutral leg direction in body frame, counter clockwise from x [deg]
+GAIT_LEG_DIRECTION = [45.0, -45.0, 135.0, -135.0]
+#Horizontal distance from hip to foot in the neutral pose [cm]
+GAIT_FOOT_RADIUS = 8.0
+#Length of the lifting link of the leg [cm]
+GAIT_LEG_LENGTH = 5.0
+#Servo angles of the standing pose (shoulder yaw grows counter clockwise)
+GAIT_SHOULDER_CENTER = [70, 80, 70, 70]
+GAIT_LEG_CENTER = [20, 165, 135, 0]
+#Direction of the leg servo that lifts the foot
+GAIT_LEG_SIGN = [1, -1, -1, 1]
+#Phase offset of each leg in the cycle (trot: diagonal pairs together)
+GAIT_PHASE = [0.0, 0.5, 0.5, 0.0]
+#Default gait parameters
+GAIT_STEP_LENGTH = 4.0		#- [cm]
+GAIT_STEP_HEIGHT = 3.5		#- [cm]
+GAIT_DUTY_FACTOR = 0.5
+GAIT_CYCLE_TIME = 1.0		#- [s]
+
 #GENERAL FINITE STATE MACHINE
 #States
 INIT = 0
@@ -47,6 +93,28 @@ STAND = 8
 TRIG = 27
 ECHO = 22
 
+#ULTRASONIC RANGING
+RANGE_PERIOD = 0.06			#- [s] time between pings
+RANGE_TIMEOUT = 0.03		#- [s] echo wait, about 5m
+RANGE_MIN = 2.0				#- [cm] valid range of the sensor
+RANGE_MAX = 400.0			#- [cm]
+RANGE_HISTORY = 9			#- pings kept by the distance estimator
+RANGE_MIN_VALID = 3			#- pings needed for a valid estimate
+RANGE_MAD_K = 3.0			#- outlier threshold in robust sigmas
+RANGE_MAD_FLOOR = 1.0		#- [cm] minimum robust sigma
+RANGE_MAX_AGE = 0.5			#- [s] older pings are dropped
+
+#I2C BUS
+#Backend: 'smbus' (real bus) or 'sim' (in-process simulator)
+BUS_BACKEND = 'smbus'
+I2C_BUS = 1
+I2C_CLOCK = 100000			#- [Hz] 100kHz (standard) or 400kHz (fast mode)
+PCA9685_ADDRESS = 0x40
+MPU6050_ADDRESS = 0x68
+#Simulator: per transaction driver overhead [s] and whether calls take the bus time
+SIM_BUS_OVERHEAD = 0.00005
+SIM_BUS_REALTIME = True
+
 #IMU REGISTERS
 #some MPU6050 Registers and their Address
 PWR_MGMT_1 = 0x6B
@@ -60,6 +128,55 @@ ACCEL_ZOUT_H = 0x3F
 GYRO_XOUT_H = 0x43
 GYRO_YOUT_H = 0x45
 GYRO_ZOUT_H = 0x47
+FIFO_EN = 0x23
+INT_STATUS = 0x3A
+USER_CTRL = 0x6A
+FIFO_COUNTH = 0x72
+FIFO_R_W = 0x74
+
+#FIFO configuration: accel, temperature and gyro (same 14 byte layout as the data registers)
+FIFO_SENSORS = 0xF8
+FIFO_SIZE = 1024
+FIFO_ENABLE_BIT = 0x40
+FIFO_RESET_BIT = 0x04
+FIFO_OFLOW_BIT = 0x10
+DATA_RDY_BIT = 0x01
+DATA_READY_TIMEOUT = 0.05	#- [s] wait for a new sample in IMU.getImuBatch
+DATA_READY_POLL_FRACTION = 0.25	#- INT_STATUS poll interval, as a fraction of the sample period
+
+#IMU STREAMING
+IMU_STREAMING = True		#- drain the FIFO from a background thread
+IMU_STREAM_RATE = 500		#- [Hz] sample rate while streaming
+IMU_RING_SIZE = 4096		#- samples kept in the ring buffer
+IMU_POLL_TIME = 0.01		#- [s] FIFO drain period
+
+#IMU CALIBRATION (stored in CALIBRATION_PATH)
+IMU_CALIBRATION_FILE = 'imuCalibration.txt'
+IMU_CALIBRATION_SAMPLES = 500
+
+#ATTITUDE ESTIMATION
+ATTITUDE_TAU = 0.5			#- [s] complementary filter time constant
+BALANCE_MAX_TILT = 11.5		#- [deg] roll/pitch limit to consider the robot balanced
+
+#CATCH DETECTION
+CATCH_WINDOW = 50			#- samples in the sliding window
+CATCH_VARIANCE = 0.02		#- [g^2] acceleration magnitude variance of a handled robot
+CATCH_JERK = 15.0			#- [g/s] mean jerk of a handled robot
+SETDOWN_VARIANCE = 0.002	#- [g^2] variance below which the robot is still
+SETDOWN_JERK = 4.0			#- [g/s] mean jerk below which the robot is still
+FALLEN_MIN_AZ = 0.5			#- [g] mean vertical acceleration of an upright robot
+CATCH_DEBOUNCE = 0.15		#- [s]
+SETDOWN_DEBOUNCE = 1.0		#- [s]
+FALLEN_DEBOUNCE = 0.5		#- [s]
+
+#Gyro full scale range written to GYRO_CONFIG: 0 (250), 1 (500), 2 (1000), 3 (2000 deg/s)
+GYRO_FS_SEL = 3
+
+#Sensitivity scale factors [LSB/g] and [LSB/(deg/s)]
+ACCEL_SCALE = 16384.0
+GYRO_SCALE = 131.0/(1 << GYRO_FS_SEL)
+
+CATCH_GYRO_RATE = 24.0		#- [deg/s] IMU.detectCatch and Robot.detectCatch fallback threshold
 
 
 
@@ -68,9 +185,27 @@ GYRO_ZOUT_H = 0x47
 # VISION TOOLBOX CONFIGURATION
 # ----------------------------
 
+#CAMERA CAPTURE
+CONTINUOUS_CAPTURE = True	#- capture from a background thread
+CAPTURE_FORMAT = "yuv"		#- "yuv": grayscale Y plane, "bgr": colour frames
+CAPTURE_BUFFERS = 3			#- preallocated frame buffers (at least 3)
+CAPTURE_TIMEOUT = 1.0		#- [s] wait for a new frame
+
+CAPTURE_PROCESS = False		#- capture in a separate process, frames shared through a FrameRing
+CAPTURE_RESOLUTION = (640, 480)
+CAPTURE_RING_SLOTS = 4		#- shared memory frame slots (at least 3)
+CAPTURE_POLL_TIME = 0.002	#- [s] reader poll period while waiting for a frame
+CAPTURE_START_TIMEOUT = 5.0	#- [s] wait for the first frame of the capture process (spawn and camera warm up)
+
+#FRAME REPLAY
+REPLAY_FPS = 32.0			#- [fps] timestamps of recorded frames, as the camera framerate
+REPLAY_READ_AHEAD = 8		#- frames decoded ahead in the background
+REPLAY_IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png")
+
 #CAMRA CALIBRATION
 CALIBRATION_PATH = "./CalibrationFiles"
 OUTPUT_PATH = "./Captures/"
+DIST_MATRIX_CACHE = True	#- reference tag distances cached in CALIBRATION_PATH, keyed by the arena constants
 
 RING_SIZE = 4 
 NUMBER_FACES = 4 
@@ -98,6 +233,11 @@ PI2 = 1.5707963268
 TAG_NUMBER_LIMITED = False
 MAX_TAG_NUMBER = 2
 
+#ARUCO DETECTION
+ARUCO_SINGLE_PASS = False	#- one candidate search, rejected small tag candidates decoded as big tags
+BATCHED_FRAME_PROCESSING = True	#- all the tags of a frame posed at once, frame data as a record array
+ARUCO_WORKERS = 4			#- detection worker threads (Pi cores), 0 runs on the calling thread
+
 
 #STATE TIMES
 EXPLORATION_TIME = 45
@@ -22,7 +22,7 @@ import cv2
 import cv2.aruco as aruco
 import numpy as np
 
-import sys, time, math, os
+import sys, time, math, os, hashlib
 
 import scipy.signal as sci
 import scipy.ndimage as sci2 
@@ -30,6 +30,23 @@ import scipy.ndimage as sci2
 import mbl_bots as ac
 
 
+def rodrigues(rvecs):
+	#--- Rotation matrices (n,3,3) of n rotation vectors (n,3), like cv2.Rodrigues for each one
+	rvecs = np.asarray(rvecs, dtype=np.float64).reshape(-1, 3)
+	theta = np.linalg.norm(rvecs, axis=1)
+	axis = rvecs / np.where(theta > 1e-12, theta, 1.0)[:, None]
+	K = np.zeros((len(rvecs), 3, 3))
+	K[:, 0, 1] = -axis[:, 2]
+	K[:, 0, 2] = axis[:, 1]
+	K[:, 1, 0] = axis[:, 2]
+	K[:, 1, 2] = -axis[:, 0]
+	K[:, 2, 0] = -axis[:, 1]
+	K[:, 2, 1] = axis[:, 0]
+	sin = np.sin(theta)[:, None, None]
+	cos = np.cos(theta)[:, None, None]
+	return np.identity(3) + sin*K + (1.0 - cos)*np.matmul(K, K)
+
+
 class Model:
 
 	def __init__(self, ring_size=4, n_of_faces=4, n_of_tag_sices=2):
@@ -48,6 +65,7 @@ class Model:
 		self.T_F_P = None
 		self.T_P_T = None
 		self.T_C_R = None
+		self.T_TAG_ABS = None
 		self.createModel()
 
 ##############################################################################
@@ -144,28 +162,69 @@ class Model:
 		self.T_F_P = self.createT_F_P()
 		self.T_P_T = self.createT_P_T()
 		self.T_C_R = self.createT_C_R()
+		self.T_TAG_ABS = self.createTagTables()
+
+##############################################################################
+
+	def createTagTables(self):
+		#--- Tag to world transform of every tag (N,4,4), indexed by the general index of getIndex
+		n_tags = self.space + ac.RING_SIZE*ac.NUMBER_FACES*ac.NUM_TAGS_SIZE2
+		T_TAG_ABS = np.zeros((n_tags, 4, 4), dtype=np.float32)
+		for index in range(n_tags):
+			id1, id2, id3, id4 = self.getTagPath(index)
+			T_TAG_ABS[index] = self.T_ABS_F[id1].dot(self.T_F_P[id1][id2]).dot(self.T_P_T[id4][id3])
+		return T_TAG_ABS
 
 ##############################################################################
 
 	def createDistMatrix(self):
-		matrix_dim = ac.RING_SIZE * ac.NUMBER_FACES * (ac.NUM_TAGS_SIZE1+ac.NUM_TAGS_SIZE2) 
-		dist_matrix = np.zeros((matrix_dim, matrix_dim), dtype=np.float32)
-		for i in range(matrix_dim):
-			for j in range(matrix_dim):
-				if i != j and dist_matrix[j,i] == 0.0:
-					dist_matrix[i,j] = np.linalg.norm(self.getVector(i) - self.getVector(j))
-		
-		dist_matrix = dist_matrix + dist_matrix.T - np.diag(dist_matrix.diagonal())
+		#--- Distances between every pair of tags, loaded from the cache file when the arena did not change
+		path = None
+		if ac.DIST_MATRIX_CACHE:
+			path = os.path.join(ac.CALIBRATION_PATH, 'distMatrix_' + self.arenaHash() + '.npy')
+			if os.path.isfile(path):
+				self.dist_matrix = np.load(path)
+				return self.dist_matrix
+
+		positions = self.getTagPositions()
+		delta = positions[:, None, :] - positions[None, :, :]
+		dist_matrix = np.sqrt(np.einsum('ijk,ijk->ij', delta, delta)).astype(np.float32)
+
+		if path is not None:
+			try:
+				tmp_path = path + '.tmp'
+				with open(tmp_path, 'wb') as cache_file:
+					np.save(cache_file, dist_matrix)
+				os.replace(tmp_path, path)
+			except OSError:
+				print('Could not write the distance matrix cache ' + path)
 
 		self.dist_matrix = dist_matrix
-		
-
 		return dist_matrix
 
+##############################################################################
+
+	def getTagPositions(self):
+		#--- (N,3) world positions of every tag, by general index
+		return self.T_TAG_ABS[:, :3, 3].astype(np.float64)
+
+	def arenaHash(self):
+		#--- Key of the cached distance matrix: the arena constants and the resulting tag positions
+		arena = (ac.RING_SIZE, ac.NUMBER_FACES, ac.NUMBER_TAG_SICES, ac.NUM_TAGS_SIZE1,
+				ac.NUM_TAGS_SIZE2, ac.A4_WIDTH, ac.A4_HEIGHT, ac.TAG1_SIZE, ac.TAG2_SIZE)
+		digest = hashlib.sha1(repr(arena).encode('utf8'))
+		digest.update(np.ascontiguousarray(self.T_TAG_ABS).tobytes())
+		return digest.hexdigest()[:16]
+
 ##############################################################################
 
 	def getVector(self, index):
+		return self.T_TAG_ABS[index][:3,3:]
 
+##############################################################################
+
+	def getTagPath(self, index):
+		#--- (face, panel, tag in panel, tag size) of a general index
 		if index < self.space:
 			id_i = (index//self.space1)*10 + index%self.space1 
 			id1 = int(id_i//10)
@@ -180,9 +239,7 @@ class Model:
 			id3 = int(id_i%3)
 			id4 = 1
 
-		matrix = self.T_ABS_F[id1].dot(self.T_F_P[id1][id2]).dot(self.T_P_T[id4][id3])
-		vec = matrix[:3,3:]
-		return vec
+		return id1, id2, id3, id4
 
 ##############################################################################
 
@@ -197,6 +254,23 @@ class Model:
 			index = index_0+self.space
 		return index
 
+##############################################################################
+
+	def getTagMask(self, ids, size_code):
+		#--- True for the tag ids that exist in the arena model
+		ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+		if size_code == ac.BIG_TAG_CODE:
+			return (ids >= 0) & (ids//10 < self.number_of_faces) & (ids%10 < self.space1)
+		return (ids >= 0) & (ids//20 < self.number_of_faces) & (ids%20 < self.space2)
+
+	def getTagIndices(self, ids, size_code):
+		#--- General indices of an array of tag ids, ValueError for ids not in the arena
+		ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+		valid = self.getTagMask(ids, size_code)
+		if not valid.all():
+			raise ValueError('Tags {} are not in the arena model'.format(ids[~valid]))
+		return self.getIndex(ids, size_code)
+
 ##############################################################################
 
 	def magnitude(self, vec1, vec2):
@@ -223,25 +297,30 @@ class Model:
 
 ##############################################################################
 
-	def getT_ABS_ROBOT(self, size, id_number, R, t):
-		T_T_C = self.getT_T_C(R,t)
-		T_ABS_ROBOT = None
+	def getT_T_C_batch(self, rvecs, tvecs):
+		#--- Camera poses in the tag frames (n,4,4) for n rvecs/tvecs at once
+		R_tc = rodrigues(rvecs).transpose(0, 2, 1)
+		tvecs = np.asarray(tvecs, dtype=np.float64).reshape(-1, 3, 1)
+		T_T_C = np.zeros((len(R_tc), 4, 4), dtype=np.float32)
+		T_T_C[:, :3, :3] = R_tc
+		T_T_C[:, :3, 3:] = -np.matmul(R_tc, tvecs)
+		T_T_C[:, 3, 3] = 1.0
+		return T_T_C
 
-		#big tags
-		if size == ac.BIG_TAG_CODE and id_number < 40:
-			id1 = int(id_number//10)
-			id2 = int((id_number%10)//2)
-			id3 = int(id_number%2)
-			id4 = 0
+##############################################################################
 
-		#small tags
-		if size == ac.SMALL_TAG_CODE:
-			id1 = int(id_number//20)
-			id2 = int((id_number%20)//3)
-			id3 = int(id_number%3)
-			id4 = 1
-		
-		T_ABS_ROBOT = self.T_ABS_F[id1].dot(self.T_F_P[id1][id2]).dot(self.T_P_T[id4][id3]).dot(T_T_C).dot(self.T_C_R)   
+	def getT_ABS_ROBOT_batch(self, indices, rvecs, tvecs, T_T_C=None):
+		#--- Robot poses in the world (n,4,4) from n detections of the tags with the given general indices
+		if T_T_C is None:
+			T_T_C = self.getT_T_C_batch(rvecs, tvecs)
+		return np.matmul(np.matmul(self.T_TAG_ABS[indices], T_T_C), self.T_C_R)
+
+##############################################################################
+
+	def getT_ABS_ROBOT(self, size, id_number, R, t):
+		T_T_C = self.getT_T_C(R,t)
+		index = int(self.getTagIndices(id_number, size)[0])
+		T_ABS_ROBOT = self.T_TAG_ABS[index].dot(T_T_C).dot(self.T_C_R)
 
 		return T_ABS_ROBOT
 
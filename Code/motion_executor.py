@@ -0,0 +1,107 @@
+import threading
+import logging
+from concurrent.futures import Future, wait
+import queue
+
+from move_player import MoveCancelled
+
+
+class MotionExecutor(threading.Thread):
+	"""Runs robot moves in a background thread.
+
+	Commands are queued with submit() and run one after the other; each one
+	gets a Future that completes when the move ends (or carries the
+	MoveCancelled exception if it was aborted), so the caller can keep
+	capturing and processing frames while the robot walks. The player's
+	abort flag is cleared before the aborted move's Future completes, so
+	moves played directly afterwards are not cancelled too.
+	"""
+	def __init__(self, player):
+		super(MotionExecutor, self).__init__()
+		self.daemon = True
+		self.player = player
+		self.commands = queue.Queue()
+		self.current = None
+		self.running = True
+		self.lock = threading.Lock()
+		#Bumped by cancel(), commands submitted before it are dropped
+		self.generation = 0
+		#Commands submitted and not finished yet, queued or running
+		self.pending = 0
+
+	def submit(self, func, *args, **kwargs):
+		future = Future()
+		with self.lock:
+			self.pending += 1
+			self.commands.put((future, self.generation, func, args, kwargs))
+		return future
+
+	def run(self):
+		while self.running:
+			command = self.commands.get()
+			if command is None:
+				break
+			(future, generation, func, args, kwargs) = command
+			with self.lock:
+				#Taken off the queue just before a cancel() drained it
+				if generation != self.generation:
+					future.cancel()
+				if not future.set_running_or_notify_cancel():
+					self.pending -= 1
+					continue
+				self.player.abort.clear()
+				self.current = future
+			result = None
+			error = None
+			try:
+				result = func(*args, **kwargs)
+			except MoveCancelled as e:
+				error = e
+			except Exception as e:
+				logging.exception('Move failed')
+				error = e
+			with self.lock:
+				self.current = None
+				self.pending -= 1
+				self.player.abort.clear()
+			if error is None:
+				future.set_result(result)
+			else:
+				future.set_exception(error)
+
+	def cancel(self):
+		#Drops every pending command and aborts the one being executed
+		with self.lock:
+			self.generation += 1
+			while True:
+				try:
+					command = self.commands.get_nowait()
+				except queue.Empty:
+					break
+				if command is None:
+					#Keep the stop request
+					self.commands.put(None)
+					break
+				command[0].cancel()
+				self.pending -= 1
+			if self.current is not None:
+				self.player.abort.set()
+
+	def wait(self, timeout=None):
+		#Waits for the move being executed (not the queued ones) to end
+		future = self.current
+		if future is not None:
+			wait([future], timeout)
+
+	def busy(self):
+		#Counted from submit() to the end of the command, so there is no gap
+		#between taking a command off the queue and starting it
+		return self.pending > 0
+
+	def currentPose(self):
+		return self.player.getPose()
+
+	def stop(self):
+		self.cancel()
+		self.running = False
+		self.commands.put(None)
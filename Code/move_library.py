@@ -0,0 +1,157 @@
+import os
+import glob
+import logging
+import numpy as np
+import mbl_bots
+
+
+def moveName(file):
+	#'/path/LoCoQuad_turnRight.movefile.txt' --> 'turnRight'
+	name = os.path.basename(file)
+	if name.startswith(mbl_bots.MOVEFILE_PREFIX):
+		name = name[len(mbl_bots.MOVEFILE_PREFIX):]
+	if name.endswith(mbl_bots.MOVEFILE_SUFFIX):
+		name = name[:-len(mbl_bots.MOVEFILE_SUFFIX)]
+	return name
+
+
+def movePath(file):
+	#Cache key of a movefile: its normalized absolute path
+	return os.path.normcase(os.path.realpath(file))
+
+
+class CompiledMove(object):
+	"""Keyframe table of a movefile, ready to be sent to the servo driver.
+
+	Every line of the movefile is one row of the table (actuator name, raw
+	position, channel, 12-bit count and delay). Consecutive lines without
+	delay are grouped into a frame, closed by the first line with a delay,
+	so each frame is a set of simultaneous servo targets followed by a wait.
+	"""
+	__slots__ = ('name', 'file', 'mtime', 'names', 'positions', 'channels',
+				'counts', 'delays', 'frameStart', 'frameDelay', 'frames')
+
+	def __init__(self, name, file, mtime, names, positions, channels, counts, delays):
+		self.name = name
+		self.file = file
+		self.mtime = mtime
+		self.names = names
+		self.positions = np.asarray(positions, dtype=np.int16)
+		self.channels = np.asarray(channels, dtype=np.uint8)
+		self.counts = np.asarray(counts, dtype=np.uint16)
+		self.delays = np.asarray(delays, dtype=np.float64)
+
+		#Frame boundaries: rows frameStart[f] to frameStart[f+1] are sent together
+		ends = np.flatnonzero(self.delays > 0.0) + 1
+		if len(ends) == 0 or ends[-1] != len(self.delays):
+			ends = np.append(ends, len(self.delays))
+		self.frameStart = np.concatenate(([0], ends)).astype(np.int32)
+		self.frameDelay = self.delays[self.frameStart[1:]-1]
+
+		#Plain int tuples for the driver, so the playback loop does no conversions.
+		#Channels are sorted (last write wins) so the driver can send them as
+		#runs of consecutive registers.
+		self.frames = []
+		for f in range(len(self.frameDelay)):
+			a, b = self.frameStart[f], self.frameStart[f+1]
+			target = {}
+			for i in range(a, b):
+				target[int(self.channels[i])] = int(self.counts[i])
+			channels = tuple(sorted(target))
+			self.frames.append((channels,
+								tuple(target[c] for c in channels),
+								float(self.frameDelay[f])))
+
+	def __len__(self):
+		return len(self.names)
+
+	def nFrames(self):
+		return len(self.frames)
+
+	def duration(self):
+		return float(np.sum(self.frameDelay))
+
+
+class MoveLibrary(object):
+	"""Loads every movefile of a directory once and keeps it compiled in memory.
+
+	Compiled moves are cached by movefile path. The moves of the library
+	directory can also be requested by name ('turnRight').
+	"""
+	def __init__(self, directory, acc_table, checkMtime=True):
+		super(MoveLibrary, self).__init__()
+		self.directory = directory
+		self.checkMtime = checkMtime
+		self.moves = {}			#movefile path --> CompiledMove
+		self.byName = {}		#move name --> movefile path, library directory only
+		self.acc_table = acc_table
+		self.loadAll()
+
+	def loadAll(self):
+		pattern = os.path.join(self.directory, mbl_bots.MOVEFILE_PREFIX + '*' + mbl_bots.MOVEFILE_SUFFIX)
+		for file in sorted(glob.glob(pattern)):
+			try:
+				self.byName[moveName(file)] = self.load(file).file
+			except ValueError as e:
+				logging.warning('Skipping movefile %s: %s', file, e)
+		logging.debug('%d moves loaded from %s', len(self.moves), self.directory)
+
+	def load(self, file):
+		move = self.compile(file)
+		self.moves[move.file] = move
+		return move
+
+	def compile(self, file):
+		file = movePath(file)
+		mtime = os.path.getmtime(file)
+		with open(file) as data:
+			lines = [i.strip().split() for i in data]
+		lines = [l for l in lines if len(l) > 0]
+		if len(lines) == 0:
+			raise ValueError('empty movefile')
+
+		n_moves = int(lines[0][0])
+		if len(lines)-1 < n_moves:
+			raise ValueError('header says %d moves but only %d found' % (n_moves, len(lines)-1))
+
+		names = []
+		positions = []
+		delays = []
+		for j in range(n_moves):
+			line = lines[j+1]
+			if len(line) != 3:
+				raise ValueError('line %d is corrupted: %s' % (j+2, ' '.join(line)))
+			names.append(line[0])
+			positions.append(int(line[1]))
+			delays.append(float(line[2]))
+
+		idx = self.acc_table.indices(names)
+		channels = self.acc_table.channel[idx]
+		counts = self.acc_table.pose2counts(positions, idx)
+		return CompiledMove(moveName(file), file, mtime, names, positions, channels, counts, delays)
+
+	def get(self, move):
+		#Accepts a move name ('turnRight') or the path of a movefile
+		if os.path.dirname(move) or os.path.isfile(move):
+			path = movePath(move)
+		else:
+			path = self.byName.get(moveName(move))
+			if path is None:
+				raise KeyError('Unknown move: %s' % move)
+		compiled = self.moves.get(path)
+		if compiled is None:
+			if os.path.isfile(path):
+				return self.load(path)
+			raise KeyError('Unknown move: %s' % move)
+
+		if self.checkMtime:
+			try:
+				if os.path.getmtime(compiled.file) != compiled.mtime:
+					logging.debug('Movefile %s changed, recompiling', compiled.file)
+					compiled = self.load(compiled.file)
+			except OSError:
+				pass
+		return compiled
+
+	def names(self):
+		return sorted(self.byName.keys())
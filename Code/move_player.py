@@ -0,0 +1,144 @@
+import time
+import threading
+import numpy as np
+import mbl_bots
+
+
+class JitterStats(object):
+	"""Per-step timing statistics of the move player (values in seconds)"""
+	def __init__(self, bins=mbl_bots.PLAYER_JITTER_BINS):
+		super(JitterStats, self).__init__()
+		#Histogram edges in ms, last bucket collects everything above
+		self.bins = np.asarray(bins, dtype=np.float64)
+		self.reset()
+
+	def reset(self):
+		self.steps = 0
+		self.lateSum = 0.0
+		self.lateSqSum = 0.0
+		self.lateMax = 0.0
+		self.writeSum = 0.0
+		self.writeMax = 0.0
+		self.histogram = np.zeros(len(self.bins)+1, dtype=np.int64)
+
+	def add(self, lateness, writeTime):
+		self.steps += 1
+		self.lateSum += lateness
+		self.lateSqSum += lateness*lateness
+		if lateness > self.lateMax: self.lateMax = lateness
+		self.writeSum += writeTime
+		if writeTime > self.writeMax: self.writeMax = writeTime
+		self.histogram[np.searchsorted(self.bins, lateness*1000.0, side='right')] += 1
+
+	def meanLateness(self):
+		if self.steps == 0: return 0.0
+		return self.lateSum/self.steps
+
+	def jitter(self):
+		#Standard deviation of the lateness
+		if self.steps == 0: return 0.0
+		mean = self.lateSum/self.steps
+		return max(self.lateSqSum/self.steps - mean*mean, 0.0)**0.5
+
+	def meanWrite(self):
+		if self.steps == 0: return 0.0
+		return self.writeSum/self.steps
+
+	def summary(self):
+		msg = "steps = {}\tlate mean = {:.2f}ms\tlate max = {:.2f}ms\tjitter = {:.2f}ms\twrite mean = {:.2f}ms\n".format(
+			self.steps, self.meanLateness()*1000.0, self.lateMax*1000.0, self.jitter()*1000.0, self.meanWrite()*1000.0)
+		low = 0.0
+		for i in range(len(self.histogram)):
+			if i < len(self.bins):
+				msg += "  [{:6.1f}, {:6.1f}) ms: {}\n".format(low, self.bins[i], self.histogram[i])
+				low = self.bins[i]
+			else:
+				msg += "  [{:6.1f},    inf) ms: {}\n".format(low, self.histogram[i])
+		return msg
+
+
+class MoveCancelled(Exception):
+	"""Raised inside a move when the player is asked to abort it"""
+	pass
+
+
+class MovePlayer(object):
+	"""Plays compiled moves against monotonic-clock deadlines.
+
+	Each frame is scheduled at the sum of the authored delays (scaled by
+	speed) since the start of the move, so the time spent writing to the
+	bus is absorbed by the next wait instead of accumulating. A move that
+	starts right after the previous one ended continues its timeline, so
+	repeated cycles (e.g. three turnRight in a row) do not drift either.
+	"""
+	def __init__(self, pwm, clock=time.monotonic):
+		super(MovePlayer, self).__init__()
+		self.pwm = pwm
+		self.clock = clock
+		self.stats = JitterStats()
+		self.lastDeadline = None
+		#Last count sent to every channel (None until first written)
+		self.pose = [None]*mbl_bots.PWM_CHANNELS
+		self.abort = threading.Event()
+
+	def send(self, channels, counts):
+		self.pwm.setPWMFrame(channels, counts)
+		pose = self.pose
+		for i in range(len(channels)):
+			pose[channels[i]] = counts[i]
+
+	def waitUntil(self, deadline):
+		#Sleeps until the deadline, waking up at once if the move is aborted
+		remaining = deadline-self.clock()
+		if remaining > 0.0:
+			if self.abort.wait(remaining):
+				raise MoveCancelled()
+		elif self.abort.is_set():
+			raise MoveCancelled()
+
+	def getPose(self):
+		return list(self.pose)
+
+	def play(self, table, speed=1):
+		now = self.clock()
+		deadline = now
+		if self.lastDeadline is not None and 0.0 <= now-self.lastDeadline < mbl_bots.PLAYER_CHAIN_TIME:
+			deadline = self.lastDeadline
+
+		for (channels, counts, delay) in table.frames:
+			start = self.clock()
+			self.send(channels, counts)
+			writeTime = self.clock()-start
+			if(delay > 0.0):
+				deadline += delay*speed
+				self.waitUntil(deadline)
+				self.stats.add(max(self.clock()-deadline, 0.0), writeTime)
+
+		self.lastDeadline = deadline
+		return deadline
+
+	def playTrajectory(self, traj):
+		#One frame with every channel per control period
+		now = self.clock()
+		deadline = now
+		chained = False
+		if self.lastDeadline is not None and 0.0 <= now-self.lastDeadline < mbl_bots.PLAYER_CHAIN_TIME:
+			deadline = self.lastDeadline
+			#The previous cycle's end sample was left out: its slot comes first
+			chained = traj.periodic
+
+		channels = traj.channels
+		rows = traj.rows
+		for i in range(len(rows)):
+			timed = i > 0 or chained
+			if timed:
+				deadline += traj.period
+				self.waitUntil(deadline)
+			start = self.clock()
+			self.send(channels, rows[i])
+			end = self.clock()
+			if timed:
+				self.stats.add(max(start-deadline, 0.0), end-start)
+
+		self.lastDeadline = deadline
+		return deadline
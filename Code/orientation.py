@@ -0,0 +1,84 @@
+import threading
+import numpy as np
+import scipy.signal as sci
+import mbl_bots
+
+
+class OrientationEstimator(object):
+	"""Complementary filter fusing accelerometer and gyro into roll/pitch/yaw.
+
+	Roll and pitch follow the integrated gyro rates on short time scales
+	and the gravity direction measured by the accelerometer on long ones
+	(time constant tau). For a block of samples that is the first order
+	recurrence angle[k] = a*(angle[k-1] + rate[k]*dt[k]) + (1-a)*acc_angle[k],
+	which is evaluated for the whole block with one lfilter call, starting
+	from the state left by the previous block. Yaw is the integrated gyro
+	rate (no absolute reference). Angles are in degrees.
+	"""
+	def __init__(self, tau=mbl_bots.ATTITUDE_TAU, rate=mbl_bots.IMU_STREAM_RATE):
+		super(OrientationEstimator, self).__init__()
+		self.tau = tau
+		self.nominalDt = 1.0/rate
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		self.state = None		#[roll, pitch, yaw] after the last sample
+		self.lastTime = None
+
+	def accelAngles(self, acc):
+		roll = np.degrees(np.arctan2(acc[:, 1], acc[:, 2]))
+		pitch = np.degrees(np.arctan2(-acc[:, 0], np.hypot(acc[:, 1], acc[:, 2])))
+		return roll, pitch
+
+	def update(self, times, data):
+		#times (n,), data (n, 6) [Ax,Ay,Az,Gx,Gy,Gz] --> (n, 3) [roll, pitch, yaw]
+		n = len(times)
+		if n == 0:
+			return np.zeros((0, 3))
+		roll_acc, pitch_acc = self.accelAngles(data[:, 0:3])
+
+		with self.lock:
+			dt = np.empty(n)
+			dt[1:] = np.diff(times)
+			dt[0] = times[0]-self.lastTime if self.lastTime is not None else self.nominalDt
+			dt = np.clip(dt, 0.0, 10*self.nominalDt)
+			if self.state is None:
+				state = np.array([roll_acc[0], pitch_acc[0], 0.0])
+				dt[0] = 0.0
+			else:
+				state = self.state
+
+			meanDt = np.mean(dt[dt > 0.0]) if np.any(dt > 0.0) else self.nominalDt
+			a = self.tau/(self.tau + meanDt)
+			out = np.empty((n, 3))
+			for (axis, acc_angle) in ((0, roll_acc), (1, pitch_acc)):
+				x = a*data[:, 3+axis]*dt + (1.0-a)*acc_angle
+				out[:, axis], _ = sci.lfilter([1.0], [1.0, -a], x, zi=[a*state[axis]])
+			out[:, 2] = state[2] + np.cumsum(data[:, 5]*dt)
+
+			self.state = out[-1].copy()
+			self.lastTime = times[-1]
+		return out
+
+	def attitude(self):
+		#Latest [roll, pitch, yaw] or None before the first sample
+		state = self.state
+		return None if state is None else state.copy()
+
+
+if __name__=='__main__':
+	#Check: a constant 90 deg/s about z, in raw counts of the configured range, integrates to 90 deg in 1 s
+	import sys
+	from IMU import IMU_SCALES
+	#Datasheet sensitivities [LSB/(deg/s)] for FS_SEL 0..3
+	sensitivity = (131.0, 65.5, 32.8, 16.4)[mbl_bots.GYRO_FS_SEL]
+	rate = mbl_bots.IMU_STREAM_RATE
+	times = np.arange(rate+1)/float(rate)
+	raw = np.zeros((len(times), 7))
+	raw[:, 2] = mbl_bots.ACCEL_SCALE
+	raw[:, 6] = 90.0*sensitivity
+	estimator = OrientationEstimator()
+	yaw = estimator.update(times, raw[:, [0,1,2,4,5,6]]/IMU_SCALES)[-1, 2]
+	print("Integrated yaw: {:.2f} deg (expected 90)".format(yaw))
+	sys.exit(0 if abs(yaw-90.0) < 0.5 else 1)
@@ -0,0 +1,111 @@
+import time
+import threading
+import logging
+import mbl_bots
+from distance_filter import DistanceEstimator
+
+
+class UltrasonicRanger(threading.Thread):
+	"""Measures distances with the HC-SR04 using GPIO edge callbacks.
+
+	A background thread sends a ping every RANGE_PERIOD seconds and waits
+	(up to RANGE_TIMEOUT) for the echo. The rising and falling edges of the
+	echo pin are timestamped in the GPIO callback, so nothing busy-waits,
+	and a missing echo only costs one timeout. Pings go to a robust
+	DistanceEstimator as they arrive and readers get its latest estimate
+	without blocking.
+	"""
+	def __init__(self, gpio, trig=mbl_bots.TRIG, echo=mbl_bots.ECHO, period=mbl_bots.RANGE_PERIOD,
+				timeout=mbl_bots.RANGE_TIMEOUT, clock=time.monotonic):
+		super(UltrasonicRanger, self).__init__()
+		self.daemon = True
+		self.gpio = gpio
+		self.trig = trig
+		self.echo = echo
+		self.period = period
+		self.timeout = timeout
+		self.clock = clock
+		self.running = threading.Event()
+		self.echoDone = threading.Event()
+		self.riseTime = None
+		self.width = None
+		self.estimator = DistanceEstimator()
+		self.lock = threading.Lock()
+		self.pings = 0
+		self.misses = 0
+
+	def setup(self):
+		self.gpio.setup(self.trig, self.gpio.OUT)
+		self.gpio.setup(self.echo, self.gpio.IN)
+		self.gpio.output(self.trig, False)
+		self.gpio.add_event_detect(self.echo, self.gpio.BOTH, callback=self.onEdge)
+
+	def start(self):
+		self.setup()
+		self.running.set()
+		super(UltrasonicRanger, self).start()
+
+	def stop(self):
+		self.running.clear()
+		if self.is_alive():
+			self.join()
+		self.gpio.remove_event_detect(self.echo)
+
+	def onEdge(self, channel):
+		#Called from the GPIO thread on both edges of the echo pin
+		now = self.clock()
+		if self.gpio.input(self.echo):
+			self.riseTime = now
+		elif self.riseTime is not None:
+			self.width = now - self.riseTime
+			self.riseTime = None
+			self.echoDone.set()
+
+	def ping(self):
+		#Returns the echo pulse width in seconds, or None on timeout
+		self.echoDone.clear()
+		self.riseTime = None
+		self.width = None
+		self.gpio.output(self.trig, True)
+		time.sleep(0.00001)
+		self.gpio.output(self.trig, False)
+		self.pings += 1
+		if not self.echoDone.wait(self.timeout):
+			self.misses += 1
+			return None
+		return self.width
+
+	def publish(self, t, distance):
+		with self.lock:
+			self.estimator.update(t, distance)
+
+	def run(self):
+		next_ping = self.clock()
+		while self.running.is_set():
+			width = self.ping()
+			if width is not None:
+				# multiply with the sonic speed (34300 cm/s)
+				# and divide by 2, because there and back
+				distance = (width * 34300.0) / 2.0
+				if mbl_bots.RANGE_MIN <= distance <= mbl_bots.RANGE_MAX:
+					self.publish(self.clock(), distance)
+				else:
+					logging.debug('Discarding out of range echo: %.1f cm', distance)
+			next_ping += self.period
+			remaining = next_ping - self.clock()
+			if remaining > 0.0:
+				time.sleep(remaining)
+			else:
+				next_ping = self.clock()
+
+	def getEstimate(self):
+		#(distance, mad, valid), distances in cm
+		with self.lock:
+			return self.estimator.estimate(self.clock())
+
+	def getDistance(self):
+		#Latest filtered distance in cm, -1.0 if there is no valid estimate
+		(distance, mad, valid) = self.getEstimate()
+		if not valid:
+			return -1.0
+		return distance
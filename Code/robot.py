@@ -1,15 +1,27 @@
 #!/usr/bin/python
 import time
 import math
-import smbus
+import numpy as np
 import sys
+import os
 import utils
 import mbl_bots
 import logging
 
 from servo_hat_driver import PCA9685
+from bus_backend import openBus
+from actuator import ActuatorTable
+from move_library import MoveLibrary
+from move_player import MovePlayer
+from trajectory import TrajectoryEngine
+from gait import GaitGenerator
+from motion_executor import MotionExecutor
 from IMU import IMU
+from imu_stream import ImuStream
+from orientation import OrientationEstimator
+from catch_detector import CatchDetector, HELD
 from camera import Cam
+from frame_ring import CaptureProcess
 from vision_tools import Vision
 
 
@@ -17,9 +29,10 @@ class Robot(object):
 	def __init__(self, file):
 		super(Robot, self).__init__()
 		(self.actuators, self.sensors) = utils.file2bot(file, mbl_bots.BOTH)
-		self.bus = smbus.SMBus(1)
-		self.pwm = PCA9685(self.bus, 0x40, debug=False)
-		self.pwm.setPWMFreq(50)
+		self.bus = openBus(mbl_bots.BUS_BACKEND, mbl_bots.I2C_BUS)
+		self.pwm = PCA9685(self.bus, mbl_bots.PCA9685_ADDRESS, debug=False)
+		self.pwm.setPWMFreq(mbl_bots.PWM_FREQ)
+		self.player = MovePlayer(self.pwm)
 		#print("My name is: ", self.actuators[0].name)
 		self.names_acc = [self.actuators[i].name for i in range(len(self.actuators))]
 		self.names_sen = [self.sensors[i].name for i in range(len(self.sensors))]
@@ -27,88 +40,124 @@ class Robot(object):
 		self.idx_sen = [i for i in range(len(self.sensors))]
 		self.acc_dic = utils.genDictionary(self.names_acc, self.idx_acc)
 		self.sen_dic = utils.genDictionary(self.names_sen, self.idx_sen)
+		self.acc_table = ActuatorTable(self.actuators)
+		self.moveLib = MoveLibrary(os.path.dirname(os.path.abspath(file)), self.acc_table)
+		self.trajEngine = TrajectoryEngine(self.acc_table.channel.tolist())
+		self.gait = GaitGenerator(self.acc_table)
+		self.motion = MotionExecutor(self.player)
+		self.motion.start()
 		self.state = mbl_bots.INIT
 		self.exploreState = mbl_bots.GETDATA
 		self.movesCode = mbl_bots.NONE
-		self.camera = Cam()
+		if mbl_bots.CAPTURE_PROCESS:
+			self.camera = CaptureProcess()
+		else:
+			self.camera = Cam()
 		self.imu = IMU(self.bus)
+		self.imuStream = None
+		self.attitude = None
+		self.catchDetector = None
+		self.catchPaused = False
+		if mbl_bots.IMU_STREAMING:
+			self.imuStream = ImuStream(self.imu)
+			self.attitude = OrientationEstimator()
+			self.imuStream.addListener(self.attitude.update)
+			self.catchDetector = CatchDetector()
+			self.imuStream.addListener(self.updateCatch)
+			self.imuStream.start()
 		self.vision = Vision()
 
 	def moveAcc(self,name,pos):
-		poss = pos*mbl_bots.SCALE_ACC + mbl_bots.CNT_ACC
-		if (poss > self.actuators[int(self.acc_dic[name])].max): poss = self.actuators[int(self.acc_dic[name])].max
-		if (poss < self.actuators[int(self.acc_dic[name])].min): poss = self.actuators[int(self.acc_dic[name])].min
-		self.pwm.setServoPulse(int(self.actuators[int(self.acc_dic[name])].adress), poss)
-		#print('Moving ', name ,'to', poss )
-
-	def executeMove(self,file,speed):
-		moves = utils.file2move(file)
-		for i in range(len(moves)):
-			self.moveAcc(moves[i].actuator, moves[i].pos)
-			if(moves[i].delay > 0.0):
-				time.sleep(moves[i].delay*speed)
-
-	def executeMoveOBO(self,file,speed,count,correction):
-		moves = utils.file2move(file)
-		if(count*2<=len(moves)):
-			self.moveAcc(moves[count*2].actuator, moves[count*2].pos)
-			self.moveAcc(moves[count*2+1].actuator, moves[count*2+1].pos)
+		(channel, count) = self.acc_table.count(name, pos)
+		self.pwm.setPWM(channel, 0, count)
+		#print('Moving ', name ,'to', pos )
+
+	def setPose(self,pose):
+		#pose: one angle per actuator, in botfile order
+		(channels, counts) = self.acc_table.pose2frame(pose)
+		self.player.send(channels, counts)
+
+	def executeMove(self,move,speed):
+		self.player.play(self.moveLib.get(move), speed)
+
+	def executeSmoothMove(self,move,speed,profile=mbl_bots.TRAJ_PROFILE):
+		#Starts from the counts last sent, or the stand pose for servos not driven yet
+		start = self.trajEngine.poseOf(self.player.getPose())
+		unknown = np.isnan(start)
+		if unknown.any():
+			start[unknown] = self.trajEngine.endPose(self.moveLib.get("stand"))[unknown]
+		traj = self.trajEngine.get(self.moveLib.get(move), speed, profile, start)
+		self.player.playTrajectory(traj)
+
+	def executeMoveOBO(self,move,speed,count,correction):
+		table = self.moveLib.get(move)
+		if(count*2+1<len(table)):
+			self.pwm.setPWM(int(table.channels[count*2]), 0, int(table.counts[count*2]))
+			self.pwm.setPWM(int(table.channels[count*2+1]), 0, int(table.counts[count*2+1]))
 			#if(moves[i].delay > 0.0):
 			#	time.sleep(moves[i].delay*speed)
 
 	def flat(self):
 		print("LoCoQuad is Flat")
-		self.executeMove("/home/pi/LoCoQuad/Code/LoCoQuad_flat.movefile.txt", 1)    
+		self.executeMove("flat", 1)    
 
 	def stand(self):
 		print("LoCoQuad is Standing")
-		self.executeMove("/home/pi/LoCoQuad/Code/LoCoQuad_stand.movefile.txt", 1)
+		self.executeMove("stand", 1)
 
 	def walkFront(self, speed=1):
 		print("LoCoQuad is Walking Forward")
-		self.executeMove("/home/pi/LoCoQuad/Code/LoCoQuad_walkFront.movefile.txt", speed)
+		self.executeMove("walkFront", speed)
 
 	def walkRight(self, speed=1):
 		print("LoCoQuad is Walking Right")
-		self.executeMove("/home/pi/LoCoQuad/Code/LoCoQuad_walkFront.movefile.txt", speed)
+		self.walk(heading=-90.0, cycleTime=mbl_bots.GAIT_CYCLE_TIME*speed)
 
 	def walkLeft(self, speed=1):
 		print("LoCoQuad is Walking Left")
-		self.executeMove("/home/pi/LoCoQuad/Code/LoCoQuad_walkFront.movefile.txt", speed)
+		self.walk(heading=90.0, cycleTime=mbl_bots.GAIT_CYCLE_TIME*speed)
+
+	def walk(self, stepLength=mbl_bots.GAIT_STEP_LENGTH, heading=0.0, turn=0.0, cycles=1,
+			stepHeight=mbl_bots.GAIT_STEP_HEIGHT, dutyFactor=mbl_bots.GAIT_DUTY_FACTOR,
+			cycleTime=mbl_bots.GAIT_CYCLE_TIME):
+		#Generated gait: heading in degrees (0 front, 90 left), turn in degrees per cycle
+		traj = self.gait.cycle(stepLength, stepHeight, heading, dutyFactor, turn, cycleTime)
+		for i in range(cycles):
+			self.player.playTrajectory(traj)
 
 	def walkBack(self, speed=1):
 		print("LoCoQuad is Walking Backwards")
-		self.executeMove("/home/pi/LoCoQuad/Code/LoCoQuad_walkBack.movefile.txt", speed)
+		self.executeMove("walkBack", speed)
 
 	def turnRight(self, speed=1):
 		print("LoCoQuad is Turning Right")
-		self.executeMove("/home/pi/LoCoQuad/Code/LoCoQuad_turnRight.movefile.txt", speed)
-		self.executeMove("/home/pi/LoCoQuad/Code/LoCoQuad_turnRight.movefile.txt", speed)
-		self.executeMove("/home/pi/LoCoQuad/Code/LoCoQuad_turnRight.movefile.txt", speed)
+		self.executeMove("turnRight", speed)
+		self.executeMove("turnRight", speed)
+		self.executeMove("turnRight", speed)
 
 	def turnLeft(self, speed=1):
 		print("LoCoQuad is Turning Left")
-		self.executeMove("/home/pi/LoCoQuad/Code/LoCoQuad_turnLeft.movefile.txt", speed)
+		self.executeMove("turnLeft", speed)
 	
 	def sayHello(self):
 		print("LoCoQuad is Saying Hi!")
-		self.executeMove("/home/pi/LoCoQuad/Code/LoCoQuad_sayHello.movefile.txt", 1)
+		self.executeMove("sayHello", 1)
 
 	def cameraPose(self):
 		print("LoCoQuad ready to take Picture")
-		self.executeMove("/home/pi/LoCoQuad/Code/LoCoQuad_cameraPose.movefile.txt", 1)
+		self.executeMove("cameraPose", 1)
 
 	def swing(self):
 		print("LoCoQuad is Swinging")
-		self.executeMove("/home/pi/LoCoQuad/Code/LoCoQuad_swing.movefile.txt", 1)	
+		self.executeMove("swing", 1)	
 
 	def shake(self):
 		print("LoCoQuad is Shaking")
-		self.executeMove("/home/pi/LoCoQuad/Code/LoCoQuad_shake.movefile.txt", 1)	
+		self.executeMove("shake", 1)	
 
 	def balancePos(self, count, correction=0):
 		print("LoCoQuad is balancing")
-		self.executeMoveOBO("/home/pi/LoCoQuad/Code/LoCoQuad_balance.movefile.txt", 1, count, correction)	
+		self.executeMoveOBO("balance", 1, count, correction)	
 
 
 	def move(self, code):
@@ -125,16 +174,35 @@ class Robot(object):
 		func = moves.get(code, lambda:None)
 		return func()
 
+	def moveAsync(self, code):
+		#Runs the move in the motion thread, returns a Future
+		return self.motion.submit(self.move, code)
+
+	def updateCatch(self, times, data):
+		#IMU stream listener: the gait vibration looks like the robot being handled,
+		#so the detector skips the samples taken while moving and restarts after the move
+		if self.motion.busy():
+			self.catchPaused = True
+			return
+		if self.catchPaused:
+			self.catchDetector.reset()
+			self.catchPaused = False
+		self.catchDetector.update(times, data)
+
 	def detectCatch(self, imu):
+		if self.catchDetector is not None:
+			return self.catchDetector.state == HELD
 		data = imu.getImuRawData()
-		print(data)
-		if(data[3] > 3 or data[4] > 3 or data[5] > 3): 
+		if(abs(data[3]) > mbl_bots.CATCH_GYRO_RATE or abs(data[4]) > mbl_bots.CATCH_GYRO_RATE or abs(data[5]) > mbl_bots.CATCH_GYRO_RATE): 
 			print("ROBOT CATCHED...do something!!")
 			return True
 		else: 
 			return False
 
 	def isBalanced(self):
+		if self.attitude is not None and self.attitude.attitude() is not None:
+			(roll, pitch, yaw) = self.attitude.attitude()
+			return abs(roll) < mbl_bots.BALANCE_MAX_TILT and abs(pitch) < mbl_bots.BALANCE_MAX_TILT
 		data = self.imu.getImuRawData()
 		if(data[0] < 0.2 or data[1] < 0.2): 
 			return True
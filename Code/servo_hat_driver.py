@@ -1,7 +1,6 @@
 #!/usr/bin/python
 import time
 import math
-import smbus
 import sys
 
 # ============================================================================
@@ -23,22 +22,50 @@ class PCA9685:
   __ALLLED_ON_H = 0xFB
   __ALLLED_OFF_L = 0xFC
   __ALLLED_OFF_H = 0xFD
+  __AI = 0x20         # MODE1 register auto-increment
+  __FULL = 0x10       # LEDn_ON_H / LEDn_OFF_H full on/off bit
+  __BLOCK_MAX = 32    # SMBus block transfer limit (8 channels)
 
   def __init__(self, bus, address=0x40, debug=False):
     #self.bus = smbus.SMBus(1)
     self.bus = bus
     self.address = address
     self.debug = debug
+    # Shadow copy of the (on, off) registers of every channel, None if unknown
+    self.shadow = [None]*16
+    self.resetWriteStats()
     if (self.debug):
       print("Reseting PCA9685")
-    self.write(self.__MODE1, 0x00)
+    self.write(self.__MODE1, self.__AI)
+
+  def resetWriteStats(self):
+    self.transactions = 0         # I2C writes sent to the chip
+    self.channelsWritten = 0      # channel updates sent
+    self.channelsSuppressed = 0   # channel updates skipped, registers already hold the value
+
+  def getWriteStats(self):
+    return {'transactions': self.transactions,
+            'written': self.channelsWritten,
+            'suppressed': self.channelsSuppressed}
+
+  def invalidate(self):
+    "Forgets the shadow registers so the next writes are always sent"
+    self.shadow = [None]*16
 
   def write(self, reg, value):
     "Writes an 8-bit value to the specified register/address"
     self.bus.write_byte_data(self.address, reg, value)
+    self.transactions += 1
     if (self.debug):
       print("I2C: Write 0x%02X to register 0x%02X" % (value, reg))
 
+  def writeBlock(self, reg, values):
+    "Writes consecutive registers in one transaction (needs auto-increment)"
+    self.bus.write_i2c_block_data(self.address, reg, values)
+    self.transactions += 1
+    if (self.debug):
+      print("I2C: Write %d bytes from register 0x%02X" % (len(values), reg))
+
   def read(self, reg):
     "Read an unsigned byte from the I2C device"
     result = self.bus.read_byte_data(self.address, reg)
@@ -67,14 +94,63 @@ class PCA9685:
     self.write(self.__MODE1, oldmode | 0x80)
     
   def setPWM(self, channel, on, off):
-    "Sets a single PWM channel"
-    self.write(self.__LED0_ON_L+4*channel, on & 0xFF)
-    self.write(self.__LED0_ON_H+4*channel, on >> 8)
-    self.write(self.__LED0_OFF_L+4*channel, off & 0xFF)
-    self.write(self.__LED0_OFF_H+4*channel, off >> 8)
+    "Sets a single PWM channel, writing only the registers that change"
+    old = self.shadow[channel]
+    if old == (on, off):
+      self.channelsSuppressed += 1
+      return
+    data = [on & 0xFF, on >> 8, off & 0xFF, off >> 8]
+    if old is None:
+      # Register contents unknown: write the whole channel
+      first, last = 0, 3
+    else:
+      # One block write from the first to the last changed byte, so the
+      # outputs update together at the STOP instead of byte by byte
+      changed = [i for i, byte in enumerate([old[0] & 0xFF, old[0] >> 8, old[1] & 0xFF, old[1] >> 8]) if byte != data[i]]
+      first, last = changed[0], changed[-1]
+    self.writeBlock(self.__LED0_ON_L+4*channel+first, data[first:last+1])
+    self.shadow[channel] = (on, off)
+    self.channelsWritten += 1
     if (self.debug):
       print("channel: %d LED_ON: %d LED_OFF: %d" % (channel,on,off))
 
+  def setPWMFrame(self, channels, offs, on=0):
+    "Sets several PWM channels, one block write per run of consecutive changed channels"
+    shadow = self.shadow
+    n = len(channels)
+    i = 0
+    while i < n:
+      # Channels already holding the value are skipped (and split the run)
+      if shadow[channels[i]] == (on, offs[i]):
+        self.channelsSuppressed += 1
+        i += 1
+        continue
+      first = i
+      start = channels[i]
+      data = []
+      while (i < n and channels[i] == start + len(data)//4
+             and len(data) < self.__BLOCK_MAX
+             and shadow[channels[i]] != (on, offs[i])):
+        off = offs[i]
+        data += [on & 0xFF, on >> 8, off & 0xFF, off >> 8]
+        i += 1
+      self.writeBlock(self.__LED0_ON_L+4*start, data)
+      for j in range(first, i):
+        shadow[channels[j]] = (on, offs[j])
+      self.channelsWritten += i - first
+    if (self.debug):
+      print("frame channels: %s LED_OFF: %s" % (list(channels), list(offs)))
+
+  def setAllPWM(self, on, off):
+    "Sets every PWM channel at once through the ALL_LED registers"
+    self.writeBlock(self.__ALLLED_ON_L, [on & 0xFF, on >> 8, off & 0xFF, off >> 8])
+    self.shadow = [(on, off)]*16
+
+  def allOff(self):
+    "Turns every channel fully off (servos go limp)"
+    self.write(self.__ALLLED_OFF_H, self.__FULL)
+    self.invalidate()
+
   def setServoPulse(self, channel, pulse):
     "Sets the Servo Pulse,The PWM frequency must be 50HZ"
     pulse = pulse*4096/20000 #PWM frequency is 50HZ,the period is 20000us
@@ -0,0 +1,137 @@
+from collections import OrderedDict
+import numpy as np
+import mbl_bots
+
+
+#Normalized motion profiles s(u), u and s in [0,1]
+def linearProfile(u):
+	return u
+
+def cubicProfile(u):
+	#Zero velocity at both ends
+	return u*u*(3.0-2.0*u)
+
+def minJerkProfile(u):
+	#Zero velocity and acceleration at both ends
+	u3 = u*u*u
+	return u3*(10.0+u*(-15.0+6.0*u))
+
+PROFILES = {
+	'linear': linearProfile,
+	'cubic': cubicProfile,
+	'minjerk': minJerkProfile,
+}
+
+
+class Trajectory(object):
+	"""Servo counts of a move sampled at a fixed control rate.
+
+	A periodic trajectory (a gait cycle) leaves out its end sample, which is
+	the first sample of the next cycle.
+	"""
+	__slots__ = ('name', 'channels', 'period', 'samples', 'rows', 'periodic')
+
+	def __init__(self, name, channels, period, samples, periodic=False):
+		self.name = name
+		self.channels = channels
+		self.period = period
+		self.periodic = periodic
+		#(n_samples, n_channels) 12-bit counts
+		self.samples = samples
+		#Plain int rows for the driver
+		self.rows = [tuple(r) for r in samples.tolist()]
+
+	def __len__(self):
+		return len(self.rows)
+
+	def duration(self):
+		if self.periodic:
+			return len(self.rows)*self.period
+		return (len(self.rows)-1)*self.period
+
+
+class TrajectoryEngine(object):
+	"""Turns compiled moves into interpolated trajectories for all actuators at once.
+
+	The target of every frame is reached at the end of the frame delay, and
+	the servos travel between consecutive keyframe poses following the
+	selected profile. Trajectories are cached per move, speed and profile.
+	"""
+	def __init__(self, channels, rate=mbl_bots.TRAJ_RATE, cacheSize=mbl_bots.TRAJ_CACHE_SIZE):
+		super(TrajectoryEngine, self).__init__()
+		self.channels = tuple(sorted(channels))
+		self.column = dict((c, i) for (i, c) in enumerate(self.channels))
+		self.period = 1.0/rate
+		self.cacheSize = cacheSize
+		self.cache = OrderedDict()
+
+	def poseOf(self, counts):
+		#Start pose row from per PWM channel counts (None when unknown), NaN where unknown
+		return np.array([np.nan if counts[c] is None else counts[c] for c in self.channels], dtype=np.float64)
+
+	def endPose(self, table):
+		#Pose a move leaves the servos in, NaN for the channels it never commands
+		pose = np.full(len(self.channels), np.nan)
+		for (channels, counts, delay) in table.frames:
+			pose[[self.column[c] for c in channels]] = counts
+		return pose
+
+	def keyframes(self, table, speed, start=None):
+		#Keyframe times (F+1,) and poses (F+1, n_channels) of a compiled move.
+		#start is the current pose, NaN (or None) where unknown: those channels
+		#start at their first commanded position, and stay NaN if never commanded
+		n_frames = len(table.frames)
+		times = np.zeros(n_frames+1, dtype=np.float64)
+		times[1:] = np.cumsum(table.frameDelay)*speed
+		poses = np.zeros((n_frames+1, len(self.channels)), dtype=np.float64)
+
+		if start is None:
+			start = np.full(len(self.channels), np.nan)
+		start = np.array(start, dtype=np.float64)
+		for (channels, counts, delay) in table.frames:
+			for i in range(len(channels)):
+				col = self.column[channels[i]]
+				if np.isnan(start[col]):
+					start[col] = counts[i]
+		poses[0] = start
+
+		for f in range(n_frames):
+			(channels, counts, delay) = table.frames[f]
+			poses[f+1] = poses[f]
+			poses[f+1, [self.column[c] for c in channels]] = counts
+		return times, poses
+
+	def build(self, table, speed=1, profile='minjerk', start=None):
+		times, poses = self.keyframes(table, speed, start)
+		n_seg = len(times)-1
+		total = times[-1]
+
+		t = np.arange(0.0, total-0.5*self.period, self.period)
+		t = np.append(t, total)
+		seg = np.clip(np.searchsorted(times, t, side='right')-1, 0, n_seg-1)
+		dur = times[seg+1]-times[seg]
+		u = np.ones_like(t)
+		moving = dur > 0.0
+		u[moving] = (t[moving]-times[seg][moving])/dur[moving]
+		s = PROFILES[profile](np.clip(u, 0.0, 1.0))
+
+		#Channels neither commanded nor with a known pose are left out of the frames
+		keep = ~np.isnan(poses[0])
+		p0 = poses[seg][:, keep]
+		p1 = poses[seg+1][:, keep]
+		samples = np.rint(p0 + s[:, None]*(p1-p0)).astype(np.uint16)
+		channels = tuple(c for (c, k) in zip(self.channels, keep) if k)
+		return Trajectory(table.name, channels, self.period, samples)
+
+	def get(self, table, speed=1, profile='minjerk', start=None):
+		key = (table.file, table.mtime, float(speed), profile,
+				None if start is None else tuple(-1 if np.isnan(v) else int(v) for v in start))
+		traj = self.cache.get(key)
+		if traj is None:
+			traj = self.build(table, speed, profile, start)
+			self.cache[key] = traj
+			if len(self.cache) > self.cacheSize:
+				self.cache.popitem(last=False)
+		else:
+			self.cache.move_to_end(key)
+		return traj
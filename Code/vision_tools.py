@@ -218,4 +218,24 @@ class Vision:
 		return processed_data
 
 ###############################################################################
+
+	def replay(self, source):
+		#Analyzes every frame of a FrameSource, yields (index, processed_data)
+		for (frame, timestamp, index) in source:
+			yield index, self.analyze(frame)
+
 ###############################################################################
+###############################################################################
+
+if __name__ == '__main__':
+	#Replays a recording: python vision_tools.py <video file | image directory>
+	from frame_source import openSource
+	vision = Vision()
+	source = openSource(sys.argv[1])
+	start = time.time()
+	n_frames = 0
+	for index, data in vision.replay(source):
+		n_frames += 1
+	elapsed = time.time() - start
+	print('{} frames in {:.2f} s ({:.1f} fps)'.format(n_frames, elapsed, n_frames/max(elapsed, 1e-9)))
+	source.close()